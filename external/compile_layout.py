@@ -4,6 +4,7 @@ import re, sys, os
 import argparse
 import json
 import shutil, subprocess
+import glob, hashlib, multiprocessing, io
 
 # Lua code templates
 bodyLua = """--------------------------------------------------------------------------------
@@ -59,6 +60,9 @@ labelLua = """Label {
     alignment = { %(alignment)s, MOAITextBox.LEFT_JUSTIFY },
 }"""
 
+# placeholder for children in templates, they are written by LuaWriter in between template parts
+CHILDREN_MARK = '\0'
+
 def makeLoc(x, y):
     if x != 0 or y != 0:
         return 'loc = {%f, %f, 0},' % (x, y)
@@ -69,65 +73,146 @@ def makeColor(r, g, b, a):
         return 'color = {%f, %f, %f, %f},' % (r, g, b, a)
     return ''
 
-class LayoutParser(object):
-    indentLevel = 3
-    offsetX = 0
-    offsetY = 0
-    fontPathCache = {}
+class FontIndex(object):
+    """FontIndex
+    Persistent map of font name to system font path, mtime and content hash.
+    fontfinder is executed only for unknown names or when font file changed since last lookup.
+    """
+    def __init__(self, path = None):
+        super(FontIndex, self).__init__()
+        self.path = path
+        self.entries = {}
+        self.updates = {}
+        if path and os.path.isfile(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    def find(self, fontName):
+        entry = self.entries.get(fontName)
+        if entry and os.path.isfile(entry['path']) and os.path.getmtime(entry['path']) == entry['mtime']:
+            return entry['path']
+
+        selfDir = os.path.dirname(os.path.realpath(__file__))
+        path = subprocess.check_output([os.path.join(selfDir, 'fontfinder'), fontName], stderr=subprocess.STDOUT).strip().decode('utf-8')
+        if not path:
+            return None
+
+        entry = {'path' : path, 'mtime' : os.path.getmtime(path), 'hash' : fileHash(path)}
+        self.entries[fontName] = self.updates[fontName] = entry
+        return path
+
+    def hash(self, fontName):
+        return self.entries[fontName]['hash']
+
+    def sourceHash(self, path):
+        """
+        Returns content hash of font file, hash from index is reused while file mtime is unchanged
+        """
+        if not os.path.isfile(path):
+            return None
+        for entry in self.entries.values():
+            if entry['path'] == path and os.path.getmtime(path) == entry['mtime']:
+                return entry['hash']
+        return fileHash(path)
+
+    def merge(self, updates):
+        self.entries.update(updates)
+        self.updates.update(updates)
+
+    def save(self):
+        if self.path and self.updates:
+            writeIfChanged(self.path, json.dumps(self.entries, indent = 2, sort_keys = True))
+            self.updates = {}
 
-    """LayoutParser"""
-    def __init__(self, params):
+class LayoutParser(object):
+    """LayoutParser
+    Keeps all state of a single compilation job, so separate instances can run in parallel.
+    """
+    def __init__(self, params, fontIndex = None):
         super(LayoutParser, self).__init__()
         self.params = params
-
-    def reindent(self, s):
-        s = s.split('\n')
-        s = [(self.indentLevel * 4 * ' ') + line for line in s]
-        s = '\n'.join(s)
-        return s
+        self.fontIndex = fontIndex or FontIndex(params.get('fontIndex'))
+        self.fontPathCache = {}
+        self.strings = None
+        # output font file -> {'source' : system font path, 'chars' : set of characters used by labels}
+        self.usedFonts = {}
 
     def affirmFont(self, fontName):
         fontPathCache = self.fontPathCache
         if not fontName in fontPathCache:
-            selfDir = os.path.dirname(os.path.realpath(__file__))
-            path = subprocess.check_output([os.path.join(selfDir, 'fontfinder'), fontName], stderr=subprocess.STDOUT).strip()
+            path = self.fontIndex.find(fontName)
             if path:
                 fontPathCache[fontName] = path
                 outDir = self.params['fontsFolder']
                 if not os.path.isdir(outDir):
-                    os.makedirs(outDir)
-                shutil.copyfile(path, os.path.join(outDir, os.path.basename(path)))
+                    try:
+                        os.makedirs(outDir)
+                    except OSError:
+                        # created by another job meanwhile
+                        if not os.path.isdir(outDir):
+                            raise
+                # subset fonts are written after all layouts are compiled
+                if not self.params.get('subsetFonts'):
+                    copyIfChanged(path, os.path.join(outDir, os.path.basename(path)), self.fontIndex.hash(fontName))
             else:
                 print("Font not found in system", fontName)
                 print("Aborting...")
                 exit(0)
         
         fileName = os.path.basename(fontPathCache[fontName])
+        fontFile = os.path.join(self.params['fontsFolder'], fileName)
+        if not fontFile in self.usedFonts:
+            self.usedFonts[fontFile] = {'source' : fontPathCache[fontName], 'hash' : self.fontIndex.hash(fontName), 'chars' : set()}
         return os.path.join(self.params['fontPrefix'], fileName)
 
+    def localizedText(self, key):
+        """
+        Returns all translations of the key found in string tables from params
+        """
+        if self.strings is None:
+            self.strings = loadStrings(self.params.get('strings') or [])
+        return self.strings.get(key, [])
+
+    def addFontChars(self, fontName, obj):
+        fontFile = os.path.join(self.params['fontsFolder'], os.path.basename(self.fontPathCache[fontName]))
+        chars = self.usedFonts[fontFile]['chars']
+        chars.update(obj['text'])
+        if 'l' in obj['flags']:
+            for text in self.localizedText(obj['text']):
+                chars.update(text)
+
     def generateLayout(self, layout, outName):
+        chunks = []
+        self.writeLayout(layout, outName, chunks.append)
+        return ''.join(chunks)
+
+    def writeLayout(self, layout, outName, write):
+        """
+        Builds node tree for layout and serializes it with write callable
+        """
         self.screenWidth = layout['size'][0]
         self.screenHeight = layout['size'][1]
 
-        children = ""
-        for obj in layout['layout']:
-            children = children + self.makeObject(obj) + ','
-            if obj != layout['layout'][-1]:
-                children = children + '\n'
+        objects = layout['layout']
+        children = [(self.makeObject(obj, 0, 0), obj != objects[-1]) for obj in objects]
 
-        return bodyLua % (outName, children)
+        writer = LuaWriter(write)
+        before, after = (bodyLua % (outName, CHILDREN_MARK)).split(CHILDREN_MARK)
+        writer.write(before)
+        writer.writeChildren(children, 3)
+        writer.write(after)
 
-    def makeObject(self, obj):
+    def makeObject(self, obj, offsetX, offsetY):
         factory = {
             "spr" : self.makeSprite,
             "grp" : self.makeGroup,
             "lbl" : self.makeLabel,
             "btn" : self.makeButton
         }
-        return factory[obj['type']](obj)
+        return factory[obj['type']](obj, offsetX, offsetY)
 
-    def makeSprite(self, obj):
-        x, y, width, height = self.transformCoords(obj['pos'][0], obj['pos'][1], obj['size'][0], obj['size'][1])
+    def makeSprite(self, obj, offsetX, offsetY):
+        x, y, width, height = self.transformCoords(obj['pos'][0], obj['pos'][1], obj['size'][0], obj['size'][1], offsetX, offsetY)
         data = {
             'name' : obj['name'],
             'fileName' : obj['fileName'],
@@ -137,40 +222,24 @@ class LayoutParser(object):
         }
 
         if data['name'] == '' and data['loc'] == '':
-            return self.reindent(spriteFuncLua % data)
+            return LayoutNode(spriteFuncLua, data)
         else:
-            return self.reindent(spriteTableLua % data)
-
-    def makeGroup(self, obj):
-        initialIndent = self.indentLevel
-        initialOffsetX = self.offsetX
-        initialOffsetY = self.offsetY
+            return LayoutNode(spriteTableLua, data)
 
-        x, y, width, height = self.transformCoords(obj['pos'][0], obj['pos'][1], obj['size'][0], obj['size'][1])
+    def makeGroup(self, obj, offsetX, offsetY):
+        x, y, width, height = self.transformCoords(obj['pos'][0], obj['pos'][1], obj['size'][0], obj['size'][1], offsetX, offsetY)
         data = {
             'name' : obj['name'],
             'loc' : makeLoc(x, y),
         }
 
-        children = ""
-        self.indentLevel = 2
-        self.offsetX = self.offsetX + x
-        self.offsetY = self.offsetY + y
-
         # reverse order in group (illustrator exports different ordering in layers and groups)
+        node = LayoutNode(groupLua, data)
         for child in obj['children'][::-1]:
-            children = children + self.makeObject(child) + ','
-            if child != obj['children'][0]:
-                children = children + '\n'
-
-        self.indentLevel = initialIndent
-        self.offsetX = initialOffsetX
-        self.offsetY = initialOffsetY
-
-        data['children'] = children
-        return self.reindent(groupLua % data)
+            node.children.append((self.makeObject(child, offsetX + x, offsetY + y), child != obj['children'][0]))
+        return node
 
-    def makeLabel(self, obj):
+    def makeLabel(self, obj, offsetX, offsetY):
         alignmentTypes = {
             "center" : "MOAITextBox.CENTER_JUSTIFY",
             "left" : "MOAITextBox.LEFT_JUSTIFY",
@@ -178,7 +247,7 @@ class LayoutParser(object):
         }
 
         ry = float(self.params['targetHeight']) / self.screenHeight
-        x, y, width, height = self.transformCoords(obj['pos'][0], obj['pos'][1], obj['size'][0], obj['size'][1])
+        x, y, width, height = self.transformCoords(obj['pos'][0], obj['pos'][1], obj['size'][0], obj['size'][1], offsetX, offsetY)
         text = ('l' in obj['flags']) and 'LocalizedString([=[%s]=])' or '[=[%s]=]'
         r, g, b, a = obj['color']
 
@@ -194,84 +263,386 @@ class LayoutParser(object):
             'color' : makeColor(r, g, b, a),
         }
 
-        return self.reindent(labelLua % data)
+        self.addFontChars(obj['fontName'], obj)
+        return LayoutNode(labelLua, data)
 
-    def makeButton(self, obj):
-        initialIndent = self.indentLevel
-        initialOffsetX = self.offsetX
-        initialOffsetY = self.offsetY
-
-        x, y, width, height = self.transformCoords(obj['pos'][0], obj['pos'][1], obj['size'][0], obj['size'][1])
+    def makeButton(self, obj, offsetX, offsetY):
+        x, y, width, height = self.transformCoords(obj['pos'][0], obj['pos'][1], obj['size'][0], obj['size'][1], offsetX, offsetY)
         data = {
             'name' : obj['name'],
             'loc' : makeLoc(x, y),
         }
 
         flags = obj['flags']
+        offsetX, offsetY = offsetX + x, offsetY + y
         
         file_base, file_ext = os.path.splitext(obj['normalSprite']['fileName'])
 
-        self.indentLevel = 1
-        self.offsetX = self.offsetX + x
-        self.offsetY = self.offsetY + y
-        
-        normalSprite = self.makeObject(obj['normalSprite']).split('\n')
-        normalSprite[0] = normalSprite[0].lstrip()
-        buttonChildren = "    normalSprite = %s," % '\n'.join(normalSprite)
+        node = LayoutNode(buttonLua, data)
+        node.fields.append(('normalSprite', self.makeObject(obj['normalSprite'], offsetX, offsetY)))
 
         if 'activeSprite' in obj:
-            activeSprite = self.makeObject(obj['activeSprite']).split('\n')
-            activeSprite[0] = activeSprite[0].lstrip()
-            buttonChildren = buttonChildren + "\n    activeSprite = %s," % '\n'.join(activeSprite)
+            node.fields.append(('activeSprite', self.makeObject(obj['activeSprite'], offsetX, offsetY)))
         elif 'a' in flags:
             aDict = obj['normalSprite'].copy()
             aDict['fileName'] = file_base + '_active' + file_ext
-            activeSprite = self.makeObject(aDict).split('\n')
-            activeSprite[0] = activeSprite[0].lstrip()
-            buttonChildren = buttonChildren + "\n    activeSprite = %s," % '\n'.join(activeSprite)
+            node.fields.append(('activeSprite', self.makeObject(aDict, offsetX, offsetY)))
 
         if 'disabledSprite' in obj:
-            disabledSprite = self.makeObject(obj['disabledSprite']).split('\n')
-            disabledSprite[0] = disabledSprite[0].lstrip()
-            buttonChildren = buttonChildren + "\n    disabledSprite = %s," % '\n'.join(disabledSprite)
+            node.fields.append(('disabledSprite', self.makeObject(obj['disabledSprite'], offsetX, offsetY)))
         elif 'd' in flags:
             dDict = obj['normalSprite'].copy()
             dDict['fileName'] = file_base + '_disabled' + file_ext
-            disabledSprite = self.makeObject(dDict).split('\n')
-            disabledSprite[0] = disabledSprite[0].lstrip()
-            buttonChildren = buttonChildren + "\n    disabledSprite = %s," % '\n'.join(disabledSprite)
+            node.fields.append(('disabledSprite', self.makeObject(dDict, offsetX, offsetY)))
 
         if 'label' in obj:
-            label = self.makeObject(obj['label']).split('\n')
-            label[0] = label[0].lstrip()
-            buttonChildren = buttonChildren + "\n    label = %s," % '\n'.join(label)
+            node.fields.append(('label', self.makeObject(obj['label'], offsetX, offsetY)))
 
-        children = ''
         if 'children' in obj:
-            self.indentLevel = 2
-            for child in obj['children']:
-                children = children + self.makeObject(child) + ','
-                if child != obj['children'][-1]:
-                    children = children + '\n'
-            self.indentLevel = 1
-            buttonChildren = buttonChildren + """\n    children = {
-%s
-}""" % children
-
-        data['children'] = buttonChildren
-
-        self.indentLevel = initialIndent
-        self.offsetX = initialOffsetX
-        self.offsetY = initialOffsetY
+            node.children = [(self.makeObject(child, offsetX, offsetY), child != obj['children'][-1]) for child in obj['children']]
 
-        return self.reindent(buttonLua % data)
+        return node
 
-    def transformCoords(self, x, y, width, height):
+    def transformCoords(self, x, y, width, height, offsetX, offsetY):
         x = float(x) - 0.5 * self.screenWidth
         y = 0.5 * self.screenHeight - float(y)
         rx = float(self.params['targetWidth']) / self.screenWidth
         ry = float(self.params['targetHeight']) / self.screenHeight
-        return -self.offsetX + self.params['offsetX'] + rx * x, -self.offsetY + self.params['offsetY'] + ry * y, rx * float(width), ry * float(height)
+        return -offsetX + self.params['offsetX'] + rx * x, -offsetY + self.params['offsetY'] + ry * y, rx * float(width), ry * float(height)
+
+
+class LayoutNode(object):
+    """LayoutNode
+    Object of compiled layout with resolved coordinates.
+    template: lua code template, filled with data
+    fields: list of (name, node) written inside template before children (button sprites and label)
+    children: list of (node, newline) where newline tells whether line break follows the node
+    """
+    def __init__(self, template, data):
+        super(LayoutNode, self).__init__()
+        self.template = template
+        self.data = data
+        self.fields = []
+        self.children = None if template is buttonLua else []
+
+    def write(self, writer):
+        if self.template is groupLua:
+            before, after = (groupLua % dict(self.data, children = CHILDREN_MARK)).split(CHILDREN_MARK)
+            writer.write(before)
+            writer.writeChildren(self.children, 2)
+            writer.write(after)
+        elif self.template is buttonLua:
+            before, after = (buttonLua % dict(self.data, children = CHILDREN_MARK)).split(CHILDREN_MARK)
+            writer.write(before)
+            for i, (name, node) in enumerate(self.fields):
+                writer.write("%s    %s = " % (i and '\n' or '', name))
+                writer.begin(1, inline = True)
+                node.write(writer)
+                writer.end()
+                writer.write(',')
+            if self.children is not None:
+                writer.write("\n    children = {\n")
+                writer.writeChildren(self.children, 2)
+                writer.write("\n}")
+            writer.write(after)
+        else:
+            writer.write(self.template % self.data)
+
+
+class LuaWriter(object):
+    """LuaWriter
+    Writes lua code of layout nodes through write callable in a single pass, keeping track of indentation.
+    Every line gets indentation of all nodes it is nested in, even empty ones.
+    """
+    def __init__(self, write):
+        super(LuaWriter, self).__init__()
+        self.out = write
+        self.indent = ''
+        self.indentStack = []
+        self.lineStart = True
+
+    def write(self, text):
+        lines = text.split('\n')
+        for i, line in enumerate(lines):
+            if i > 0:
+                if self.lineStart:
+                    self.out(self.indent)
+                self.out('\n')
+                self.lineStart = True
+            if line:
+                if self.lineStart:
+                    self.out(self.indent)
+                    self.lineStart = False
+                self.out(line)
+
+    def begin(self, level, inline = False):
+        """
+        Starts nested node indented by level. Node starting in the middle of line keeps its own
+        indentation on the first line, unless it's inline value (like button sprites)
+        """
+        indent = level * 4 * ' '
+        if not self.lineStart and not inline:
+            self.out(indent)
+        self.indentStack.append(self.indent)
+        self.indent = self.indent + indent
+
+    def end(self):
+        self.indent = self.indentStack.pop()
+
+    def writeChildren(self, children, level):
+        for node, newline in children:
+            self.begin(level)
+            node.write(self)
+            self.end()
+            self.write(newline and ',\n' or ',')
+
+
+def copyAtomic(src, dst):
+    """
+    Copies file through temporary name, so parallel jobs never see half written file
+    """
+    tmp = "%s.%d.tmp" % (dst, os.getpid())
+    shutil.copyfile(src, tmp)
+    if os.path.exists(dst) and sys.platform.startswith('win'):
+        os.remove(dst)
+    os.rename(tmp, dst)
+
+def copyIfChanged(src, dst, srcHash):
+    """
+    Copies file unless destination already has the same content. Returns True if file was copied
+    """
+    if os.path.isfile(dst) and os.path.getsize(dst) == os.path.getsize(src) and fileHash(dst) == srcHash:
+        return False
+    copyAtomic(src, dst)
+    return True
+
+def writeIfChanged(path, data):
+    """
+    Writes data (text or bytes) to file only when its content differs. Returns True if file was written
+    """
+    mode = isinstance(data, bytes) and 'b' or ''
+    if os.path.isfile(path):
+        with open(path, 'r' + mode) as f:
+            if f.read() == data:
+                return False
+    outDir = os.path.dirname(path)
+    if outDir and not os.path.isdir(outDir):
+        os.makedirs(outDir)
+    with open(path, 'w' + mode) as f:
+        f.write(data)
+    return True
+
+def loadStrings(paths):
+    """
+    Loads localized string tables from json files. Tables can be flat {key : text}
+    or per language {lang : {key : text}}. Returns {key : [texts]}
+    """
+    strings = {}
+    def collect(table):
+        for key, value in table.items():
+            if isinstance(value, dict):
+                collect(value)
+            else:
+                strings.setdefault(key, []).append(value)
+
+    for path in paths:
+        with io.open(path, encoding = 'utf-8') as f:
+            collect(json.load(f))
+    return strings
+
+def subsetFont(source, dest, chars):
+    """
+    Writes font with glyphs only for given characters. Requires fontTools,
+    falls back to copying the whole font when it is not installed or font is a collection (.ttc).
+    Returns True if font file was written
+    """
+    try:
+        from fontTools import subset
+    except ImportError:
+        print("fontTools not found, copying whole font %s (pip install fonttools)" % source)
+        return copyIfChanged(source, dest, fileHash(source))
+
+    with open(source, "rb") as f:
+        isCollection = f.read(4) == b'ttcf'
+    if isCollection:
+        print("Font collections can't be subset, copying whole font %s" % source)
+        return copyIfChanged(source, dest, fileHash(source))
+
+    options = subset.Options()
+    options.notdef_outline = True
+    options.name_IDs = ['*']
+    options.name_languages = ['*']
+    font = subset.load_font(source, options)
+    subsetter = subset.Subsetter(options)
+    subsetter.populate(text = ''.join(sorted(chars)))
+    subsetter.subset(font)
+
+    data = io.BytesIO()
+    subset.save_font(font, data, options)
+    font.close()
+    return writeIfChanged(dest, data.getvalue())
+
+def subsetFonts(usedFonts, extraChars):
+    """
+    Writes trimmed fonts. usedFonts: {font file : {'source' : path, 'chars' : iterable}}
+    """
+    for fontFile, info in sorted(usedFonts.items()):
+        chars = set(info['chars']) | set(extraChars)
+        written = subsetFont(info['source'], fontFile, chars)
+        print("%s %s (%d chars)" % (written and "Subset" or "Unchanged", fontFile, len(chars)))
+
+def mergeUsedFonts(target, usedFonts):
+    for fontFile, info in usedFonts.items():
+        if not fontFile in target:
+            target[fontFile] = {'source' : info['source'], 'chars' : set()}
+        target[fontFile]['chars'].update(info['chars'])
+    return target
+
+def fileHash(path):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def paramsHash(params):
+    """
+    Hash of compilation params together with this script, so changes of compiler invalidate outputs too
+    """
+    digest = hashlib.sha1(json.dumps(params, sort_keys = True).encode('utf-8'))
+    for path in [os.path.realpath(__file__).replace('.pyc', '.py')] + (params.get('strings') or []):
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def globBase(pattern):
+    """
+    Returns leading part of glob pattern without magic characters
+    """
+    parts = os.path.normpath(pattern).split(os.sep)
+    base = []
+    for part in parts[:-1]:
+        if glob.has_magic(part):
+            break
+        base.append(part)
+    return os.sep.join(base) or '.'
+
+def collectLayouts(inputs):
+    """
+    Expands list of files, directories and glob patterns into sorted list of (path, relative path) for layout json files.
+    Relative path keeps subfolder structure of directory inputs and of glob matches below the pattern's non-magic prefix.
+    Raises IOError for inputs that match nothing.
+    """
+    files = {}
+    for pattern in inputs:
+        paths = glob.glob(pattern)
+        if not paths and not os.path.exists(pattern):
+            raise IOError("Input not found: %s" % pattern)
+        for path in (paths or [pattern]):
+            if not glob.has_magic(pattern):
+                base = os.path.isdir(path) and path or os.path.dirname(path)
+            else:
+                base = globBase(pattern)
+            if os.path.isdir(path):
+                for root, dirs, names in os.walk(path):
+                    for name in names:
+                        if name.lower().endswith('.json') and not name.startswith('.'):
+                            fullPath = os.path.join(root, name)
+                            files[fullPath] = os.path.relpath(fullPath, base)
+            else:
+                files[path] = os.path.relpath(path, base or '.')
+    return sorted(files.items())
+
+def isBatchInput(inputs):
+    return len(inputs) > 1 or any([os.path.isdir(x) or glob.has_magic(x) for x in inputs])
+
+def compileLayout(inputFile, outputFile, params, fontIndex = None):
+    """
+    Compiles single layout. Returns (written, fonts): whether output file was rewritten
+    and fonts used by layout as {font file : {'source' : path, 'hash' : source hash, 'chars' : sorted string}}
+    """
+    layoutParser = LayoutParser(params, fontIndex)
+    with open(inputFile) as f_in:
+        layoutDict = json.load(f_in)
+    written = writeIfChanged(outputFile, layoutParser.generateLayout(layoutDict, outputFile))
+    fonts = {}
+    for fontFile, info in layoutParser.usedFonts.items():
+        fonts[fontFile] = {'source' : info['source'], 'hash' : info['hash'], 'chars' : ''.join(sorted(info['chars']))}
+    return written, fonts
+
+def _compileJob(job):
+    inputFile, outputFile, params = job
+    fontIndex = FontIndex(params.get('fontIndex'))
+    try:
+        written, fonts = compileLayout(inputFile, outputFile, params, fontIndex)
+        return {'input' : inputFile, 'output' : outputFile, 'written' : written, 'fonts' : fonts, 'fontIndex' : fontIndex.updates}
+    except (Exception, SystemExit) as e:
+        return {'input' : inputFile, 'output' : outputFile, 'error' : "%s: %s" % (type(e).__name__, e), 'fontIndex' : fontIndex.updates}
+
+def buildLayouts(jobs, params, manifestPath, processes = None, force = False):
+    """
+    Compiles list of (inputFile, outputFile) jobs in a process pool.
+    Layouts whose input, params, source fonts and outputs did not change since last build (according to manifest) are skipped.
+    Returns number of failed jobs.
+    """
+    manifest = {}
+    if manifestPath and os.path.isfile(manifestPath) and not force:
+        with open(manifestPath) as f:
+            manifest = json.load(f)
+
+    fontIndex = FontIndex(params.get('fontIndex'))
+    fontHashes = {}
+    def fontChanged(info):
+        if not info['source'] in fontHashes:
+            fontHashes[info['source']] = fontIndex.sourceHash(info['source'])
+        return info.get('hash') != fontHashes[info['source']]
+
+    pHash = paramsHash(params)
+    pending = []
+    hashes = {}
+    for inputFile, outputFile in jobs:
+        hashes[outputFile] = fileHash(inputFile)
+        entry = manifest.get(outputFile)
+        if (entry and entry['input'] == hashes[outputFile] and entry['params'] == pHash and
+            all([os.path.isfile(x) for x in [outputFile] + list(entry['fonts'])]) and
+            not any([fontChanged(info) for info in entry['fonts'].values()])):
+            continue
+        pending.append((inputFile, outputFile, params))
+
+    failed = 0
+    results = []
+    if len(pending) > 1 and processes != 1:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_compileJob, pending)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_compileJob(job) for job in pending]
+
+    for result in results:
+        fontIndex.merge(result['fontIndex'])
+        if 'error' in result:
+            failed += 1
+            manifest.pop(result['output'], None)
+            print("Failed to compile %s: %s" % (result['input'], result['error']))
+            continue
+        manifest[result['output']] = {'input' : hashes[result['output']], 'params' : pHash, 'fonts' : result['fonts']}
+        print("%s %s" % (result['written'] and "Compiled" or "Unchanged", result['output']))
+
+    print("%d layouts: %d compiled, %d up to date, %d failed" % (len(jobs), len(pending) - failed, len(jobs) - len(pending), failed))
+
+    fontIndex.save()
+
+    if manifestPath:
+        writeIfChanged(manifestPath, json.dumps(manifest, indent = 2, sort_keys = True))
+
+    if params.get('subsetFonts'):
+        usedFonts = {}
+        for inputFile, outputFile in jobs:
+            if outputFile in manifest:
+                mergeUsedFonts(usedFonts, manifest[outputFile]['fonts'])
+        if pending or not all([os.path.isfile(x) for x in usedFonts]):
+            subsetFonts(usedFonts, params['subsetChars'])
+    return failed
 
 
 def main():
@@ -283,7 +654,15 @@ def main():
     parser.add_argument('-oy', '--offsetY', help="Canvas offset Y (in virtual coordinates)", default = 0, type=int)
     parser.add_argument('-fonts', help="Output path for font files from layout", default = "fonts", type=str)
     parser.add_argument('-fp', '--fontPrefix', help="Font path prefix that will be added to included font file names", default = "", type=str)
-    parser.add_argument('file', help="Input file")
+    parser.add_argument('--fontIndex', help="Persistent font name to path index shared across runs", default = os.path.join(os.path.expanduser('~'), '.compile_layout_fonts.json'), type=str)
+    parser.add_argument('--subset', help="Write fonts trimmed to characters used by labels (batch mode uses all layouts in manifest). Requires fontTools", action='store_true')
+    parser.add_argument('--subsetChars', help="Characters always kept in subset fonts, e.g. for text set at runtime (default: printable ASCII)", default = ''.join([chr(x) for x in range(32, 127)]), type=str)
+    parser.add_argument('--strings', help="Localized string tables (json) used to collect characters of LocalizedString labels", default = [], nargs='*')
+    parser.add_argument('-od', '--outDir', help="Batch mode: output directory for compiled layouts (default: next to inputs)", default = None, type=str)
+    parser.add_argument('-j', '--jobs', help="Batch mode: number of worker processes (default: cpu count)", default = None, type=int)
+    parser.add_argument('--manifest', help="Batch mode: manifest with hashes of compiled layouts (default: .layout_manifest.json in output dir)", default = None, type=str)
+    parser.add_argument('--force', help="Batch mode: ignore manifest and recompile everything", action='store_true')
+    parser.add_argument('file', help="Input file. Several files, directories or glob patterns turn on batch mode", nargs='+')
     args = parser.parse_args()
 
     params = {
@@ -293,13 +672,47 @@ def main():
         "targetHeight" : args.height,
         "fontsFolder" : args.fonts,
         "fontPrefix" : args.fontPrefix,
+        "fontIndex" : args.fontIndex,
+        "subsetFonts" : args.subset,
+        "subsetChars" : args.subsetChars,
+        "strings" : args.strings,
     }
 
-    layoutParser = LayoutParser(params)
-    with open(args.file) as f_in:
-        layoutDict = json.load(f_in)
-        with open(args.out, "w") as f:
-            f.write(layoutParser.generateLayout(layoutDict, args.out))
+    if not isBatchInput(args.file) and args.outDir is None:
+        layoutParser = LayoutParser(params)
+        with open(args.file[0]) as f_in:
+            layoutDict = json.load(f_in)
+            with open(args.out, "w") as f:
+                f.write(layoutParser.generateLayout(layoutDict, args.out))
+        layoutParser.fontIndex.save()
+        if args.subset:
+            subsetFonts(layoutParser.usedFonts, args.subsetChars)
+        return
+
+    try:
+        layouts = collectLayouts(args.file)
+    except IOError as e:
+        parser.error(str(e))
+
+    jobs = []
+    inputsByOutput = {}
+    for inputFile, relPath in layouts:
+        if args.outDir is not None:
+            outputFile = os.path.join(args.outDir, os.path.splitext(relPath)[0] + '.lua')
+        else:
+            outputFile = os.path.splitext(inputFile)[0] + '.lua'
+        inputsByOutput.setdefault(os.path.normpath(outputFile), []).append(inputFile)
+        jobs.append((inputFile, outputFile))
+
+    duplicates = [(output, inputs) for output, inputs in sorted(inputsByOutput.items()) if len(inputs) > 1]
+    for output, inputs in duplicates:
+        print("Several layouts compile into %s: %s" % (output, ', '.join(inputs)))
+    if duplicates:
+        sys.exit(1)
+
+    manifestPath = args.manifest or os.path.join(args.outDir or '.', '.layout_manifest.json')
+    if buildLayouts(jobs, params, manifestPath, args.jobs, args.force):
+        sys.exit(1)
 
 
 if __name__ == '__main__':
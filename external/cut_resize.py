@@ -1,119 +1,223 @@
-import os, sys
-import Image, ImageDraw
-
-def resize_border(x_times, border_region, border_x_size, border_y_size, border_num):
-	if border_x_size < border_y_size:
-		size = border_y_size
-		print size
-
-		for x in range(size-1):
-			if border_region.getpixel((border_num,x))[0] == 255 and border_region.getpixel((border_num,x+1))[0] == 0: #esli poslednij belij pixel pered poloskoj
-				len1=x+1
-			else: len1 = 555
-			if border_region.getpixel((border_num,x))[0] == 0 and border_region.getpixel((border_num,x+1))[0] == 255: #esli poslednij chornij a potom belij
-				len2=x+1
-		if len1==555:
-			return border_region.resize((1, size/x_times))
-
-		len_white_1 = len1
-		len_black = len2 - len1
-		len_white_2 = size - len2
-		print len_white_1, len_black, len_white_2
-		if len_white_1%x_times==0 and len_white_2%x_times==0 and len_black%x_times==0:
-			resized_border_x_times = border_region.resize((1, size/x_times))
-		else:
-			print "cannot resize x_times border for", infile
-		resized_border_x_times.save("left_x2.png","PNG")
-		return resized_border_x_times
-
-	else:
-		size = border_x_size
-
-		for x in range(size-1):
-			if border_region.getpixel((x,border_num))[0] == 255 and border_region.getpixel((x+1,border_num))[0] == 0: #esli poslednij belij pixel pered poloskoj
-				len1=x+1
-			else: len1=555
-			if border_region.getpixel((x,border_num))[0] == 0 and border_region.getpixel((x+1,border_num))[0] == 255: #esli poslednij chornij a potom belij
-				len2=x+1
-		if len1==555:
-			return border_region.resize((1, size/x_times))
-
-
-		len_white_1 = len1
-		len_black = len2 - len1
-		len_white_2 = size - len2
-		if len_white_1%x_times==0 and len_white_2%x_times==0 and len_black%x_times==0:
-			resized_border_x_times = border_region.resize((size/2, 1))
-		else:
-			print "cannot resize x_times border for", infile
-
-		return resized_border_x_times
-
-
-
-
+#!/usr/bin/env python
+
+import sys, os, argparse
+import json, hashlib, io
+
+import numpy as np
+from PIL import Image
+
+# output subfolder for each content scale, shared with nine-patch-resizer.py
+SCALE_FOLDERS = [(4, 'ipad-hd'), (2, 'hd'), (1, 'sd')]
+RESAMPLE = getattr(Image, 'LANCZOS', None) or Image.ANTIALIAS
+INDEX_FILE = 'ninepatches.lua'
+
+# Lua code templates
+indexLua = """--------------------------------------------------------------------------------
+-- %s
+--
+-- WARNING: Do not edit!
+-- This file is auto generated, all changes will be lost.
+--------------------------------------------------------------------------------
+return {
+%s
+}
+"""
+
+entryLua = """    [%s] = {scale = %d, width = %d, height = %d, columns = {%s}, rows = {%s}, padding = {%d, %d, %d, %d}},"""
+
+
+def isNinePatch(path):
+    return path.lower().endswith('.9.png')
+
+def fileHash(path):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def saveIfChanged(image, path):
+    """
+    Encodes image and writes it only when file content differs, so unchanged outputs
+    are not pushed again by live reload. Returns True if file was written
+    """
+    data = io.BytesIO()
+    image.save(data, Image.registered_extensions().get(os.path.splitext(path)[1].lower(), 'PNG'))
+    data = data.getvalue()
+    if os.path.isfile(path):
+        with open(path, "rb") as f:
+            if f.read() == data:
+                return False
+
+    outDir = os.path.dirname(path)
+    if outDir and not os.path.isdir(outDir):
+        try:
+            os.makedirs(outDir)
+        except OSError:
+            # created by another worker meanwhile
+            if not os.path.isdir(outDir):
+                raise
+    with open(path, "wb") as f:
+        f.write(data)
+    return True
+
+def findSegments(image):
+    """
+    Finds marker runs on all four 1px borders of nine patch in one pass.
+    Returns {'top', 'bottom', 'left', 'right' : [(start, end)]} in content coordinates, end is exclusive
+    """
+    alpha = np.asarray(image.convert("RGBA"))[:, :, 3] > 0
+    borders = [
+        ('top', alpha[0, 1:-1]),
+        ('bottom', alpha[-1, 1:-1]),
+        ('left', alpha[1:-1, 0]),
+        ('right', alpha[1:-1, -1]),
+    ]
+
+    # borders are joined with empty separators, so every run stays inside its border
+    strip = np.concatenate([np.concatenate(([False], mask, [False])) for side, mask in borders]).astype(np.int8)
+    edges = np.diff(strip)
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+
+    segments = {}
+    offset = 0
+    for side, mask in borders:
+        # run starting at strip index i covers content pixels from i - offset
+        inside = (starts >= offset) & (starts < offset + len(mask) + 1)
+        segments[side] = [(int(s - offset), int(e - offset)) for s, e in zip(starts[inside], ends[inside])]
+        offset += len(mask) + 2
+    return segments
+
+def detectNinePatch(image, scale):
+    """
+    Returns nine patch metadata: content size, stretch columns (top border), stretch rows (left border)
+    and content padding (left, top, right, bottom) from bottom and right borders, all in pixels
+    """
+    width, height = image.size[0] - 2, image.size[1] - 2
+    segments = findSegments(image)
+
+    padding = [0, 0, 0, 0]
+    if segments['bottom']:
+        padding[0] = segments['bottom'][0][0]
+        padding[2] = width - segments['bottom'][-1][1]
+    if segments['right']:
+        padding[1] = segments['right'][0][0]
+        padding[3] = height - segments['right'][-1][1]
+
+    return {
+        'scale' : scale,
+        'width' : width,
+        'height' : height,
+        'columns' : segments['top'],
+        'rows' : segments['left'],
+        'padding' : padding,
+    }
+
+def validateScales(info, factors):
+    """
+    Returns list of errors for target scale factors where sizes or markers fall between pixels
+    """
+    errors = []
+    values = np.array([info['width'], info['height']] + info['padding'] +
+        [x for segment in info['columns'] + info['rows'] for x in segment], dtype = np.int64)
+    for factor in factors:
+        if (values % factor).any():
+            errors.append("markers or size are not aligned to 1/%d scale" % factor)
+    return errors
+
+def cutImage(image):
+    """
+    Returns image content without marker border
+    """
+    width, height = image.size
+    return image.crop((1, 1, width - 1, height - 1))
+
+def luaString(text):
+    """
+    Returns Lua 5.1 string literal, non ASCII and control bytes of UTF-8 are written as decimal escapes
+    """
+    chars = []
+    for byte in bytearray(text.encode('utf-8')):
+        if byte in (34, 92) or byte < 32 or byte > 126:
+            chars.append('\\%03d' % byte)
+        else:
+            chars.append(chr(byte))
+    return '"%s"' % ''.join(chars)
+
+def makeLuaIndex(index, name):
+    def ranges(segments):
+        return ', '.join(["{%d, %d}" % tuple(segment) for segment in segments])
+
+    entries = []
+    for fileName in sorted(index):
+        info = index[fileName]
+        entries.append(entryLua % ((luaString(fileName), info['scale'], info['width'], info['height'],
+            ranges(info['columns']), ranges(info['rows'])) + tuple(info['padding'])))
+    return indexLua % (name, '\n'.join(entries))
+
+def writeIndex(index, path):
+    """
+    Writes metadata index as lua table or json depending on file extension, unless file already has the same content
+    """
+    if path.endswith('.json'):
+        data = json.dumps(index, indent = 2, sort_keys = True)
+    else:
+        data = makeLuaIndex(index, os.path.basename(path))
+    if os.path.isfile(path):
+        with open(path) as f:
+            if f.read() == data:
+                return False
+    with open(path, "w") as f:
+        f.write(data)
+    return True
+
+def collectNinePatches(inputs):
+    files = []
+    for path in inputs:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                files += [(os.path.join(root, name), os.path.relpath(os.path.join(root, name), path)) for name in names if isNinePatch(name)]
+        else:
+            files.append((path, os.path.basename(path)))
+    return sorted(files)
 
 
 def main():
-
-	for infile in sys.argv[1:]:
-		picture = Image.open(infile)
-
-		xsize = picture.size[0] #razmer napr (512,512)
-		ysize = picture.size[1]
-
-		box = (1, 1, xsize - 1, ysize - 1) #oblast' bez kraev        left, upper, right, lower
-		region = picture.crop(box)
-
-		left_border = (0,1,1,ysize-1)
-		left_border_region = picture.crop(left_border)
-		print 1
-		resized_left_border_x2 = resize_border(2, left_border_region, 1, ysize-2, 0)
-		print 2
-		resized_left_border_x4 = resize_border(4, left_border_region, 1, ysize-2, 0)
-		print 3
-		# resized_left_border_x4.save("left_x4.png","PNG")
-
-		top_border = (1,0,xsize-1,1)
-		top_border_region = picture.crop(top_border)
-		print 4
-		resized_top_border_x2 = resize_border(2, top_border_region, xsize-2, 1, 0)
-		print 5
-		resized_top_border_x4 = resize_border(4, top_border_region, xsize-2, 1, 0)
-		print 6
-
-		right_border = (xsize-1,1,xsize,ysize-1)
-		right_border_region = picture.crop(right_border)
-		resized_right_border_x2 = resize_border(2, right_border_region, 1, ysize-2, 0)
-		print 7
-		resized_right_border_x4 = resize_border(4, right_border_region, 1, ysize-2, 0)
-		print 8
-
-		bottom_border = (1,ysize-1,xsize-1,ysize)
-		bottom_border_region = picture.crop(bottom_border)
-		resized_bottom_border_x2 = resize_border(2, bottom_border_region, xsize-2, 1, 0)
-		print 9
-		resized_bottom_border_x4 = resize_border(4, bottom_border_region, xsize-2, 1, 0)
-		print 10
-
-
-		
-
-
-		if (xsize-2)%2.0==0 and (ysize-2)%2.0==0:
-			print 1
-			resized_picture_x2 = region.resize( ((xsize-2)/2, (ysize-2)/2 ))
-			# new_box_x2 = (0,0,(xsize-2)/2, (ysize-2)/2)
-			# new_picture_x2 = picture.paste(new_box_x2, resized_picture_x2)
-			# new_picture_x2.save("new_x2.png","PNG")
-		else:
-			print "cannot resize x2 for", infile
-		
-		if (xsize-2)%4.0==0 and (ysize-2)%4.0==0:
-			resized_picture_x4 = region.resize( (xsize-2)/4.0, (ysize-2)/4.0 )
-		else:
-			print "cannot resize x4 for", infile
-
+    parser = argparse.ArgumentParser(description = "Cuts marker border from nine patches, writes them for every scale and builds stretch metadata index")
+    parser.add_argument('-s', '--scale', required = False, choices=['1', '2', '4'], help = "Input images scale", default='4')
+    parser.add_argument('-o', '--out', help="Output directory. Subfolders will be created: sd, hd, ipad-hd", default="output")
+    parser.add_argument('-i', '--index', help="Metadata index file name in output directory (.lua or .json)", default=INDEX_FILE)
+    parser.add_argument('files', help="Nine patch images (.9.png) or directories", nargs='+')
+    args = parser.parse_args()
+
+    inputScale = int(args.scale)
+    targets = [(folder, inputScale // folderScale) for folderScale, folder in SCALE_FOLDERS if folderScale <= inputScale]
+
+    index = {}
+    failed = 0
+    for path, name in collectNinePatches(args.files):
+        image = Image.open(path).convert("RGBA")
+        info = detectNinePatch(image, inputScale)
+        errors = validateScales(info, [factor for folder, factor in targets])
+        if errors:
+            failed += 1
+            for error in errors:
+                print("cannot resize %s: %s" % (path, error))
+            continue
+
+        index[name.replace(os.sep, '/')] = info
+        content = cutImage(image)
+        for folder, factor in targets:
+            outPath = os.path.join(args.out, folder, name)
+            if factor > 1:
+                saveIfChanged(content.resize((info['width'] // factor, info['height'] // factor), RESAMPLE), outPath)
+            else:
+                saveIfChanged(content, outPath)
+
+    if not os.path.isdir(args.out):
+        os.makedirs(args.out)
+    writeIndex(index, os.path.join(args.out, args.index))
+    print("%d nine patches indexed, %d failed" % (len(index), failed))
+    if failed:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,335 @@
+#!/usr/bin/env python
+
+"""
+Benchmark for compile_layout.py emitter.
+Generates synthetic wide and deep layouts, compares single pass LuaWriter emitter
+against the previous string concatenation + reindent implementation and checks
+that both produce identical output. Also checks that second batch build skips unchanged layouts.
+"""
+
+import os, sys, argparse
+import time, tempfile, shutil, json, io
+
+import compile_layout
+from compile_layout import bodyLua, spriteFuncLua, spriteTableLua, buttonLua, groupLua, labelLua, makeLoc, makeColor
+
+
+class LegacyLayoutParser(compile_layout.LayoutParser):
+    """
+    Previous implementation: every object renders into a string which is reindented at every nesting level.
+    Object methods are kept as they were, fonts are resolved by the current affirmFont
+    """
+    def __init__(self, params):
+        super(LegacyLayoutParser, self).__init__(params)
+        self.indentLevel = 3
+        self.offsetX = 0
+        self.offsetY = 0
+
+    def reindent(self, s):
+        s = s.split('\n')
+        s = [(self.indentLevel * 4 * ' ') + line for line in s]
+        s = '\n'.join(s)
+        return s
+
+    def generateLayout(self, layout, outName):
+        self.screenWidth = layout['size'][0]
+        self.screenHeight = layout['size'][1]
+
+        children = ""
+        for obj in layout['layout']:
+            children = children + self.makeObject(obj) + ','
+            if obj != layout['layout'][-1]:
+                children = children + '\n'
+
+        return bodyLua % (outName, children)
+
+    def makeObject(self, obj):
+        factory = {
+            "spr" : self.makeSprite,
+            "grp" : self.makeGroup,
+            "lbl" : self.makeLabel,
+            "btn" : self.makeButton
+        }
+        return factory[obj['type']](obj)
+
+    def makeSprite(self, obj):
+        x, y, width, height = self.transformCoords(obj['pos'][0], obj['pos'][1], obj['size'][0], obj['size'][1])
+        data = {
+            'name' : obj['name'],
+            'fileName' : obj['fileName'],
+            'loc' : makeLoc(x, y),
+            'width' : width,
+            'height' : height,
+        }
+
+        if data['name'] == '' and data['loc'] == '':
+            return self.reindent(spriteFuncLua % data)
+        else:
+            return self.reindent(spriteTableLua % data)
+
+    def makeGroup(self, obj):
+        initialIndent = self.indentLevel
+        initialOffsetX = self.offsetX
+        initialOffsetY = self.offsetY
+
+        x, y, width, height = self.transformCoords(obj['pos'][0], obj['pos'][1], obj['size'][0], obj['size'][1])
+        data = {
+            'name' : obj['name'],
+            'loc' : makeLoc(x, y),
+        }
+
+        children = ""
+        self.indentLevel = 2
+        self.offsetX = self.offsetX + x
+        self.offsetY = self.offsetY + y
+
+        # reverse order in group (illustrator exports different ordering in layers and groups)
+        for child in obj['children'][::-1]:
+            children = children + self.makeObject(child) + ','
+            if child != obj['children'][0]:
+                children = children + '\n'
+
+        self.indentLevel = initialIndent
+        self.offsetX = initialOffsetX
+        self.offsetY = initialOffsetY
+
+        data['children'] = children
+        return self.reindent(groupLua % data)
+
+    def makeLabel(self, obj):
+        alignmentTypes = {
+            "center" : "MOAITextBox.CENTER_JUSTIFY",
+            "left" : "MOAITextBox.LEFT_JUSTIFY",
+            "right" : "MOAITextBox.RIGHT_JUSTIFY",
+        }
+
+        ry = float(self.params['targetHeight']) / self.screenHeight
+        x, y, width, height = self.transformCoords(obj['pos'][0], obj['pos'][1], obj['size'][0], obj['size'][1])
+        text = ('l' in obj['flags']) and 'LocalizedString([=[%s]=])' or '[=[%s]=]'
+        r, g, b, a = obj['color']
+
+        data = {
+            'name' : obj['name'],
+            'text' : text % obj['text'],
+            'fontName' : self.affirmFont(obj['fontName']),
+            'fontSize' : obj['fontSize'] * ry,
+            'alignment' : alignmentTypes[obj['alignment']],
+            'loc' : makeLoc(x, y),
+            'width' : width,
+            'height' : height + 0.5 * obj['fontSize'] * ry,
+            'color' : makeColor(r, g, b, a),
+        }
+
+        return self.reindent(labelLua % data)
+
+    def makeButton(self, obj):
+        initialIndent = self.indentLevel
+        initialOffsetX = self.offsetX
+        initialOffsetY = self.offsetY
+
+        x, y, width, height = self.transformCoords(obj['pos'][0], obj['pos'][1], obj['size'][0], obj['size'][1])
+        data = {
+            'name' : obj['name'],
+            'loc' : makeLoc(x, y),
+        }
+
+        flags = obj['flags']
+        
+        file_base, file_ext = os.path.splitext(obj['normalSprite']['fileName'])
+
+        self.indentLevel = 1
+        self.offsetX = self.offsetX + x
+        self.offsetY = self.offsetY + y
+        
+        normalSprite = self.makeObject(obj['normalSprite']).split('\n')
+        normalSprite[0] = normalSprite[0].lstrip()
+        buttonChildren = "    normalSprite = %s," % '\n'.join(normalSprite)
+
+        if 'activeSprite' in obj:
+            activeSprite = self.makeObject(obj['activeSprite']).split('\n')
+            activeSprite[0] = activeSprite[0].lstrip()
+            buttonChildren = buttonChildren + "\n    activeSprite = %s," % '\n'.join(activeSprite)
+        elif 'a' in flags:
+            aDict = obj['normalSprite'].copy()
+            aDict['fileName'] = file_base + '_active' + file_ext
+            activeSprite = self.makeObject(aDict).split('\n')
+            activeSprite[0] = activeSprite[0].lstrip()
+            buttonChildren = buttonChildren + "\n    activeSprite = %s," % '\n'.join(activeSprite)
+
+        if 'disabledSprite' in obj:
+            disabledSprite = self.makeObject(obj['disabledSprite']).split('\n')
+            disabledSprite[0] = disabledSprite[0].lstrip()
+            buttonChildren = buttonChildren + "\n    disabledSprite = %s," % '\n'.join(disabledSprite)
+        elif 'd' in flags:
+            dDict = obj['normalSprite'].copy()
+            dDict['fileName'] = file_base + '_disabled' + file_ext
+            disabledSprite = self.makeObject(dDict).split('\n')
+            disabledSprite[0] = disabledSprite[0].lstrip()
+            buttonChildren = buttonChildren + "\n    disabledSprite = %s," % '\n'.join(disabledSprite)
+
+        if 'label' in obj:
+            label = self.makeObject(obj['label']).split('\n')
+            label[0] = label[0].lstrip()
+            buttonChildren = buttonChildren + "\n    label = %s," % '\n'.join(label)
+
+        children = ''
+        if 'children' in obj:
+            self.indentLevel = 2
+            for child in obj['children']:
+                children = children + self.makeObject(child) + ','
+                if child != obj['children'][-1]:
+                    children = children + '\n'
+            self.indentLevel = 1
+            buttonChildren = buttonChildren + """\n    children = {
+%s
+}""" % children
+
+        data['children'] = buttonChildren
+
+        self.indentLevel = initialIndent
+        self.offsetX = initialOffsetX
+        self.offsetY = initialOffsetY
+
+        return self.reindent(buttonLua % data)
+
+    def transformCoords(self, x, y, width, height):
+        return super(LegacyLayoutParser, self).transformCoords(x, y, width, height, self.offsetX, self.offsetY)
+
+
+# fonts are resolved to fake paths, so benchmark doesn't need fontfinder
+FONTS = {'Helvetica' : '/fonts/Helvetica.ttf', 'Georgia' : '/fonts/Georgia.ttf'}
+
+def makeSprite(i):
+    return {'type' : 'spr', 'name' : 'spr%d' % i, 'fileName' : 'image%d.png' % (i % 10), 'pos' : [10 + i % 600, 20 + i % 1000], 'size' : [32, 32]}
+
+def makeLabel(i):
+    return {'type' : 'lbl', 'name' : 'lbl%d' % i, 'text' : 'Label %d' % i, 'flags' : i % 2 and 'l' or '',
+        'fontName' : sorted(FONTS)[i % len(FONTS)], 'fontSize' : 20 + i % 8, 'alignment' : ['center', 'left', 'right'][i % 3],
+        'color' : [1, 1, 1, 1] if i % 4 else [1, 0.5, 0, 1], 'pos' : [30 + i % 500, 40 + i % 900], 'size' : [120, 24]}
+
+def makeButton(i, children = None):
+    button = {'type' : 'btn', 'name' : 'btn%d' % i, 'flags' : 'ad', 'pos' : [100 + i % 400, 200 + i % 800], 'size' : [64, 32],
+        'normalSprite' : {'type' : 'spr', 'name' : '', 'fileName' : 'button%d.png' % (i % 5), 'pos' : [100 + i % 400, 200 + i % 800], 'size' : [64, 32]}}
+    # every other button has explicit state sprites and label instead of generated ones
+    if i % 2:
+        button['activeSprite'] = dict(button['normalSprite'], fileName = 'pressed%d.png' % (i % 5))
+        button['disabledSprite'] = dict(button['normalSprite'], name = 'off', fileName = 'off%d.png' % (i % 5))
+        button['label'] = makeLabel(i)
+    if children is not None:
+        button['children'] = children
+    return button
+
+def makeWideLayout(count):
+    """
+    Flat screen with many sprites, buttons and shallow groups
+    """
+    objects = []
+    for i in range(count):
+        kind = i % 4
+        if kind == 0:
+            objects.append(makeSprite(i))
+        elif kind == 1:
+            objects.append(makeButton(i))
+        elif kind == 2:
+            objects.append(makeLabel(i))
+        else:
+            objects.append({'type' : 'grp', 'name' : 'grp%d' % i, 'pos' : [0, 0], 'size' : [640, 1136], 'children' : [makeSprite(i), makeSprite(i + 1)]})
+    return {'size' : [640, 1136], 'layout' : objects}
+
+def makeDeepLayout(depth, width):
+    """
+    Nested scroll/table like structure: groups and buttons alternate down to given depth
+    """
+    def make(level, index):
+        if level == depth:
+            return index % 2 and makeLabel(index) or makeSprite(index)
+        children = [make(level + 1, index * width + i) for i in range(width)]
+        if level % 2:
+            return makeButton(index, children)
+        return {'type' : 'grp', 'name' : 'grp%d_%d' % (level, index), 'pos' : [level, level], 'size' : [100, 100], 'children' : children}
+    return {'size' : [640, 1136], 'layout' : [make(0, i) for i in range(width)]}
+
+
+def timeIt(parserClass, params, layout):
+    layoutParser = parserClass(params)
+    layoutParser.fontPathCache.update(FONTS)
+    layoutParser.fontIndex.entries.update([(name, {'path' : path, 'mtime' : 0, 'hash' : ''}) for name, path in FONTS.items()])
+    start = time.time()
+    out = layoutParser.generateLayout(layout, "benchmark.lua")
+    return time.time() - start, out
+
+
+def checkIncrementalBuild(params, layouts):
+    """
+    Runs batch build twice over the same layouts. Returns summary lines of both runs,
+    second run must skip every layout
+    """
+    root = tempfile.mkdtemp()
+    try:
+        jobs = []
+        for name, layout in layouts:
+            inputFile = os.path.join(root, 'in', name.replace(' ', '_') + '.json')
+            if not os.path.isdir(os.path.dirname(inputFile)):
+                os.makedirs(os.path.dirname(inputFile))
+            with open(inputFile, 'w') as f:
+                json.dump(layout, f)
+            jobs.append((inputFile, os.path.join(root, 'out', name.replace(' ', '_') + '.lua')))
+
+        # font index points to fake font files, so fontfinder is not needed
+        fontIndex = {}
+        for fontName, fontPath in FONTS.items():
+            path = os.path.join(root, 'system') + fontPath
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'wb') as f:
+                f.write(fontName.encode('utf-8'))
+            fontIndex[fontName] = {'path' : path, 'mtime' : os.path.getmtime(path), 'hash' : compile_layout.fileHash(path)}
+        with open(os.path.join(root, 'fonts.json'), 'w') as f:
+            json.dump(fontIndex, f)
+
+        params = dict(params, fontIndex = os.path.join(root, 'fonts.json'), fontsFolder = os.path.join(root, 'out', 'fonts'))
+        manifestPath = os.path.join(root, 'out', '.layout_manifest.json')
+        summaries = []
+        for run in range(2):
+            stdout, sys.stdout = sys.stdout, io.StringIO() if sys.version_info[0] > 2 else io.BytesIO()
+            try:
+                failed = compile_layout.buildLayouts(jobs, params, manifestPath, 1)
+                output = sys.stdout.getvalue()
+            finally:
+                sys.stdout = stdout
+            if failed:
+                raise RuntimeError("batch build failed:\n" + output)
+            summaries.append(output.strip().split('\n')[-1])
+        return summaries
+    finally:
+        shutil.rmtree(root)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-w', '--wide', help="Object counts for wide layouts", default = [100, 1000, 5000], type=int, nargs='+')
+    parser.add_argument('-d', '--deep', help="Depths for deep layouts", default = [6, 9, 12], type=int, nargs='+')
+    parser.add_argument('-b', '--branching', help="Children per node in deep layouts", default = 2, type=int)
+    args = parser.parse_args()
+
+    params = {"offsetX" : 0, "offsetY" : 0, "targetWidth" : 320, "targetHeight" : 568, "fontsFolder" : "fonts", "fontPrefix" : ""}
+    layouts = [("wide %d" % n, makeWideLayout(n)) for n in args.wide]
+    layouts += [("deep %d" % d, makeDeepLayout(d, args.branching)) for d in args.deep]
+
+    print("%-12s %12s %12s %12s %10s %10s" % ("layout", "output, KB", "legacy, s", "current, s", "speedup", "identical"))
+    for name, layout in layouts:
+        legacy, legacyOut = timeIt(LegacyLayoutParser, params, layout)
+        current, currentOut = timeIt(compile_layout.LayoutParser, params, layout)
+        print("%-12s %12d %12.3f %12.3f %9.1fx %10s" % (name, len(currentOut) // 1024, legacy, current,
+            legacy / max(current, 1e-6), legacyOut == currentOut and "yes" or "NO"))
+
+    first, second = checkIncrementalBuild(params, layouts)
+    print("\nbatch build: %s\nrebuild:     %s" % (first, second))
+    expected = "%d layouts: 0 compiled, %d up to date, 0 failed" % (len(layouts), len(layouts))
+    if second != expected:
+        print("Incremental rebuild did not skip unchanged layouts")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,45 +1,176 @@
 #!/usr/bin/env python
 
 import sys, os, argparse
+import json, multiprocessing
 
-from PIL import Image, ImageOps
+from PIL import Image
 
-def extractBorder(image):
-    
-    pass
+from cut_resize import SCALE_FOLDERS, RESAMPLE, INDEX_FILE, isNinePatch, fileHash, saveIfChanged
+from cut_resize import detectNinePatch, validateScales, cutImage, writeIndex
 
-
-def applyBorder(image, border):
-    
-    pass
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+CACHE_FILE = '.resize_cache.json'
+# bump when output of the pipeline changes for the same settings
+PIPELINE_VERSION = 2
 
 
 def applyScale(image, scale):
-    
-    pass
+    if scale == 1:
+        return image
+    width, height = image.size
+    size = (max(1, int(round(width * scale))), max(1, int(round(height * scale))))
+    return image.resize(size, RESAMPLE)
+
+def processImage(job):
+    """
+    Decodes image once and writes it for every target (folder, scale), files with the same content are not rewritten.
+    Nine patches are written without marker border, same as cut_resize.py, their metadata goes to the index.
+    Nine patches with size or markers between pixels at some target scale are rejected, same as cut_resize.py.
+    Returns (relative path, list of warnings, nine patch metadata or None) or raises on errors
+    """
+    inputPath, relPath, outRoot, targets, inputScale = job
+    image = Image.open(inputPath)
+    image.load()
+    warnings = []
+    info = None
+
+    if isNinePatch(relPath):
+        image = image.convert("RGBA")
+        info = detectNinePatch(image, inputScale)
+        errors = validateScales(info, [int(round(1 / scale)) for folder, scale in targets])
+        if errors:
+            raise ValueError(', '.join(errors))
+        content = cutImage(image)
+    elif image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+        # palette images can't be resampled
+        content = image.convert("RGBA")
+    else:
+        content = image
+
+    for folder, scale in targets:
+        if [x for x in content.size if x * scale != int(x * scale)]:
+            warnings.append("size is not aligned to scale %g, rounded" % scale)
+        saveIfChanged(applyScale(content, scale), os.path.join(outRoot, folder, relPath))
+    return relPath, warnings, info
+
+def _processJob(job):
+    try:
+        relPath, warnings, info = processImage(job)
+        return relPath, warnings, info, None
+    except Exception as e:
+        return job[1], [], None, "%s: %s" % (type(e).__name__, e)
+
+def collectImages(in_dir):
+    images = []
+    for root, dirs, names in os.walk(in_dir):
+        for name in names:
+            if name.lower().endswith(IMAGE_EXTENSIONS) and not name.startswith('.'):
+                path = os.path.join(root, name)
+                images.append((path, os.path.relpath(path, in_dir)))
+    return sorted(images)
+
+def scaleTargets(inputScale):
+    """
+    Returns list of (folder, scale factor) for all folders with content scale not bigger than input
+    """
+    return [(folder, float(folderScale) / inputScale) for folderScale, folder in SCALE_FOLDERS if folderScale <= inputScale]
+
+def imageSettings(targets):
+    return json.dumps({'targets' : targets, 'version' : PIPELINE_VERSION}, sort_keys = True)
+
+def loadCache(out_dir):
+    cachePath = os.path.join(out_dir, CACHE_FILE)
+    if os.path.isfile(cachePath):
+        with open(cachePath) as f:
+            return json.load(f)
+    return {}
+
+def saveCache(out_dir, cache):
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    with open(os.path.join(out_dir, CACHE_FILE), "w") as f:
+        json.dump(cache, f, indent = 2, sort_keys = True)
+
+def isUpToDate(entry, imageHash, settings, out_dir, relPath, targets):
+    return (entry and entry['hash'] == imageHash and entry['settings'] == settings and
+        all([os.path.isfile(os.path.join(out_dir, folder, relPath)) for folder, scale in targets]))
+
+def cacheEntry(imageHash, settings, info):
+    entry = {'hash' : imageHash, 'settings' : settings}
+    if info:
+        entry['ninePatch'] = info
+    return entry
+
+def writeNinePatchIndex(out_dir, cache):
+    """
+    Writes index of nine patches from cache for ResourceMgr:loadNinePatchIndex. Returns True if file was written
+    """
+    index = dict([(relPath.replace(os.sep, '/'), entry['ninePatch']) for relPath, entry in cache.items() if 'ninePatch' in entry])
+    if not index and not os.path.isfile(os.path.join(out_dir, INDEX_FILE)):
+        return False
+    return writeIndex(index, os.path.join(out_dir, INDEX_FILE))
+
+def processImages(in_dir, out_dir, inputScale, processes = None, force = False):
+    """
+    Writes every image from in_dir into scale subfolders of out_dir and nine patch metadata into index.
+    Images whose content and scale settings did not change since last run are skipped.
+    Returns number of failed images.
+    """
+    targets = scaleTargets(inputScale)
+    settings = imageSettings(targets)
+    cache = not force and loadCache(out_dir) or {}
+
+    jobs = []
+    hashes = {}
+    images = collectImages(in_dir)
+    for path, relPath in images:
+        hashes[relPath] = fileHash(path)
+        if isUpToDate(cache.get(relPath), hashes[relPath], settings, out_dir, relPath, targets):
+            continue
+        jobs.append((path, relPath, out_dir, targets, inputScale))
+
+    if len(jobs) > 1 and processes != 1:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_processJob, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_processJob(job) for job in jobs]
+
+    # removed images are dropped from cache and index
+    cache = dict([(relPath, entry) for relPath, entry in cache.items() if relPath in hashes])
+    failed = 0
+    for relPath, warnings, info, error in results:
+        if error:
+            failed += 1
+            cache.pop(relPath, None)
+            print("Failed %s: %s" % (relPath, error))
+            continue
+        for warning in warnings:
+            print("Warning %s: %s" % (relPath, warning))
+        cache[relPath] = cacheEntry(hashes[relPath], settings, info)
 
+    print("%d images: %d processed, %d up to date, %d failed" % (len(images), len(jobs) - failed, len(images) - len(jobs), failed))
 
-def processImages(in_dir, out_dir, scale):
-    
-    pass
+    saveCache(out_dir, cache)
+    writeNinePatchIndex(out_dir, cache)
+    return failed
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('-s', '--scale', required = False, choices=['2', '4'], help = "Input images scale", default='2')
     parser.add_argument('-o', '--out', help="Output directory. Subfolders will be created: sd, hd, ipad-hd", default="output")
+    parser.add_argument('-j', '--jobs', help="Number of worker processes (default: cpu count)", default = None, type=int)
+    parser.add_argument('--force', help="Ignore cache and process all images", action='store_true')
     parser.add_argument('dir', help="Input directory")
     args = parser.parse_args()
 
-    initial_scale = float(args.scale)
-    output_root = args.out
-    input_dir = args.dir
+    if processImages(args.dir, args.out, int(args.scale), args.jobs, args.force):
+        sys.exit(1)
 
-    scale = 1.0
-    while initial_scale >= 1:
-        initial_scale, scale = initial_scale / 2, scale / 2
-        processImages(input_dir, output_root, scale)
-    
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+"""
+Benchmark for obj_converter.py ingestion.
+Generates synthetic grid meshes of increasing size and compares current
+streaming converter against the old OrderedSet.index() based implementation
+and checks that both produce identical vertex and index buffers.
+"""
+
+import os, argparse
+import tempfile, time
+
+import obj_converter
+
+
+def writeSyntheticObj(path, cells, groups = 1):
+    """
+    Writes (cells x cells) quad grid split into triangles. Vertices are shared
+    between neighbouring triangles like in exported meshes.
+    """
+    n = cells + 1
+    with open(path, "w") as f:
+        for y in range(n):
+            for x in range(n):
+                f.write("v %f %f %f\n" % (x, y, 0.01 * ((x * y) % 7)))
+        for y in range(n):
+            for x in range(n):
+                f.write("vt %f %f\n" % (float(x) / cells, float(y) / cells))
+        f.write("vn 0.000000 0.000000 1.000000\n")
+
+        rowsPerGroup = max(1, cells // groups)
+        for y in range(cells):
+            if y % rowsPerGroup == 0:
+                f.write("g part%d\n" % (y // rowsPerGroup))
+            for x in range(cells):
+                a = y * n + x + 1
+                b, c, d = a + 1, a + n, a + n + 1
+                f.write("f %d/%d/1 %d/%d/1 %d/%d/1\n" % (a, a, b, b, d, d))
+                f.write("f %d/%d/1 %d/%d/1 %d/%d/1\n" % (a, a, d, d, c, c))
+
+
+def legacyConvert(path):
+    """
+    Previous implementation: string tuples per vertex and linear OrderedSet.index() per face corner.
+    Returns list of (group name, vbo, ibo)
+    """
+    obj = {'vertices' : [], 'normals' : [], 'uv' : [], 'groups' : {}}
+    group = None
+    with open(path) as f:
+        for line in f:
+            s = line.split()
+            if not s:
+                continue
+            if s[0] == 'v':
+                obj['vertices'].append(tuple(s[1:]))
+            elif s[0] == 'vn':
+                obj['normals'].append(tuple(s[1:]))
+            elif s[0] == 'vt':
+                obj['uv'].append((s[1], str(1.0 - float(s[2]))))
+            elif s[0] == 'g':
+                group = obj['groups'][s[1]] = []
+            elif s[0] == 'f':
+                if group is None:
+                    group = obj['groups']['obj'] = []
+                group.append(tuple(tuple(x.split('/')) for x in s[1:]))
+
+    meshes = []
+    for name, faces in obj['groups'].items():
+        if not faces:
+            continue
+        order, seen, ibo = [], set(), []
+        for face in faces:
+            for vtx in face:
+                key = (obj['vertices'][int(vtx[0]) - 1], obj['normals'][int(vtx[2]) - 1], obj['uv'][int(vtx[1]) - 1])
+                if key not in seen:
+                    seen.add(key)
+                    order.append(key)
+                ibo.append(order.index(key))
+        meshes.append((name, [float(x) for v, vn, uv in order for x in v + vn + uv], ibo))
+    return meshes
+
+
+def currentConvert(path):
+    obj = obj_converter.readObj(path)
+    meshes = []
+    for name, group in obj['groups'].items():
+        if group:
+            vbo, ibo = obj_converter.packVBO(obj, name)
+            obj_converter.writeLuaMesh(vbo, ibo)
+            meshes.append((name, vbo, ibo))
+    return meshes
+
+
+def sameMeshes(a, b):
+    return [(name, list(vbo), list(ibo)) for name, vbo, ibo in a] == [(name, list(vbo), list(ibo)) for name, vbo, ibo in b]
+
+def timeIt(func, path):
+    start = time.time()
+    out = func(path)
+    return time.time() - start, out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--sizes', help="Grid sizes (cells per side) to test", default = [16, 32, 64, 128], type=int, nargs='+')
+    parser.add_argument('-g', '--groups', help="Number of groups in synthetic mesh", default = 1, type=int)
+    parser.add_argument('--legacy-limit', help="Skip legacy run for meshes with more triangles than this", default = 40000, type=int)
+    args = parser.parse_args()
+
+    tmpDir = tempfile.mkdtemp()
+    print("%10s %12s %12s %10s %10s" % ("triangles", "legacy, s", "current, s", "speedup", "identical"))
+    for cells in args.sizes:
+        path = os.path.join(tmpDir, "grid_%d.obj" % cells)
+        writeSyntheticObj(path, cells, args.groups)
+        triangles = 2 * cells * cells
+
+        current, currentOut = timeIt(currentConvert, path)
+        if triangles <= args.legacy_limit:
+            legacy, legacyOut = timeIt(legacyConvert, path)
+            print("%10d %12.3f %12.3f %9.1fx %10s" % (triangles, legacy, current, legacy / max(current, 1e-6),
+                sameMeshes(legacyOut, currentOut) and "yes" or "NO"))
+        else:
+            print("%10d %12s %12.3f %10s %10s" % (triangles, "-", current, "-", "-"))
+        os.remove(path)
+    os.rmdir(tmpDir)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,193 +1,435 @@
 #!/usr/bin/env python
 
 import os, sys, re, argparse
-import pprint
 import collections
+import struct
+from array import array
+
+# floats per interleaved vertex: position (3), normal (3), uv (2)
+VERTEX_SIZE = 8
+
+# Binary mesh layout (little endian, every block is 4-byte aligned):
+#   header:  magic "MOAM", uint32 version, uint32 group count
+#   groups:  char name[32], uint32 vertex format, uint32 vertex stride (bytes),
+#            uint32 vertex count, uint32 index size (2 or 4), uint32 index count,
+#            uint32 vbo offset, uint32 ibo offset
+#   data:    interleaved vbo followed by ibo for every group, offsets are from the file start
+BINARY_MAGIC = b"MOAM"
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct("<4sII")
+BINARY_GROUP = struct.Struct("<32sIIIIIII")
+BINARY_NAME_SIZE = 32
+
+# vertex format flags, position is always 3 x float32
+VERTEX_FORMAT_FLOAT = 0         # normal 3 x float32, uv 2 x float32: 32 bytes
+VERTEX_FORMAT_NORMAL_BYTE = 1   # normal 3 x normalized int8 + 1 padding byte
+VERTEX_FORMAT_UV_SHORT = 2      # uv 2 x normalized uint16
+
+# largest vertex count addressable with 16 bit indices
+MAX_SHORT_INDEX_VERTICES = 0x10000
+
+# post-transform cache model used by optimizer (LRU) and ACMR measurement (FIFO)
+OPTIMIZER_CACHE_SIZE = 32
+ACMR_CACHE_SIZE = 16
+
+
+class ObjGroup(object):
+    """
+    Faces of a single obj group, already deduplicated.
+    Every unique (v, vn, vt) index triple gets the next output slot on first use,
+    ibo holds slot numbers in face order.
+    """
+    def __init__(self, name):
+        super(ObjGroup, self).__init__()
+        self.name = name
+        self.slots = {}
+        self.corners = []
+        self.ibo = array('I')
+
+    def addCorner(self, key):
+        slot = self.slots.get(key)
+        if slot is None:
+            slot = self.slots[key] = len(self.corners)
+            self.corners.append(key)
+        self.ibo.append(slot)
+
+    def __len__(self):
+        return len(self.ibo)
 
 
 def writeLuaMesh(vbo, ibo):
-    vbo_t = "{"
-    for vtx in vbo:
-        vbo_t += "%s,%s,%s,%s,%s,%s,%s,%s," % (vtx[0] + vtx[1] + vtx[2])
-    vbo_t += '}'
+    vbo_t = "{" + ''.join(["%r," % x for x in vbo]) + "}"
+    ibo_t = "{" + ''.join(["%d," % x for x in ibo]) + "}"
+    return "{vbo = %s, ibo = %s}\n" % (vbo_t, ibo_t)
 
-    ibo_t = '{'
-    for idx in ibo:
-        ibo_t += "%s," % str(idx)
-    ibo_t += '}'
+def toBytes(arr):
+    """
+    Returns little endian bytes of array
+    """
+    if sys.byteorder != 'little':
+        arr = array(arr.typecode, arr)
+        arr.byteswap()
+    return arr.tobytes() if hasattr(arr, 'tobytes') else arr.tostring()
 
-    out = "{vbo = %s, ibo = %s}\n" % (vbo_t, ibo_t)
+def vertexStride(vertexFormat):
+    """
+    Returns size of single vertex in bytes for vertex format flags
+    """
+    stride = 12
+    stride += 4 if vertexFormat & VERTEX_FORMAT_NORMAL_BYTE else 12
+    stride += 4 if vertexFormat & VERTEX_FORMAT_UV_SHORT else 8
+    return stride
 
-    return out
+def indexSize(vertexCount):
+    return 2 if vertexCount <= MAX_SHORT_INDEX_VERTICES else 4
+
+def meshByteSize(vertexCount, indexCount, vertexFormat = VERTEX_FORMAT_FLOAT):
+    """
+    Returns size of vertex and index data in binary mesh format
+    """
+    iboSize = indexCount * indexSize(vertexCount)
+    return vertexCount * vertexStride(vertexFormat) + iboSize + (-iboSize % 4)
+
+def vertexFormatFor(vbo, quantizeNormals = False, quantizeUV = False):
+    """
+    Returns vertex format flags for vbo. UVs are quantized only when all of them are within [0, 1]
+    """
+    vertexFormat = VERTEX_FORMAT_FLOAT
+    if quantizeNormals:
+        vertexFormat |= VERTEX_FORMAT_NORMAL_BYTE
+    if quantizeUV:
+        uvs = [x for i in range(6, VERTEX_SIZE) for x in vbo[i::VERTEX_SIZE]]
+        if not uvs or (min(uvs) >= 0.0 and max(uvs) <= 1.0):
+            vertexFormat |= VERTEX_FORMAT_UV_SHORT
+    return vertexFormat
+
+def encodeVertices(vbo, vertexFormat):
+    """
+    Returns little endian bytes of interleaved vertex data in given format
+    """
+    if vertexFormat == VERTEX_FORMAT_FLOAT:
+        return toBytes(array('f', vbo))
+
+    layout = "<3f"
+    layout += "3bx" if vertexFormat & VERTEX_FORMAT_NORMAL_BYTE else "3f"
+    layout += "2H" if vertexFormat & VERTEX_FORMAT_UV_SHORT else "2f"
+    packer = struct.Struct(layout)
+
+    def snorm8(x):
+        return max(-127, min(127, int(round(x * 127.0))))
+
+    def unorm16(x):
+        return int(round(x * 65535.0))
+
+    data = []
+    for i in range(0, len(vbo), VERTEX_SIZE):
+        vtx = list(vbo[i : i + VERTEX_SIZE])
+        if vertexFormat & VERTEX_FORMAT_NORMAL_BYTE:
+            vtx[3:6] = [snorm8(x) for x in vtx[3:6]]
+        if vertexFormat & VERTEX_FORMAT_UV_SHORT:
+            vtx[6:8] = [unorm16(x) for x in vtx[6:8]]
+        data.append(packer.pack(*vtx))
+    return b"".join(data)
+
+def writeBinaryMesh(meshes, output_file, quantizeNormals = False, quantizeUV = False):
+    """
+    Writes list of (name, vbo, ibo) into binary mesh file.
+    Vertex data is stored as float32 unless quantization is requested,
+    indices as uint16 when vertex count allows it.
+    """
+    blocks = []
+    offset = BINARY_HEADER.size + BINARY_GROUP.size * len(meshes)
+    for name, vbo, ibo in meshes:
+        encodedName = name.encode('utf-8')
+        if len(encodedName) >= BINARY_NAME_SIZE:
+            raise ValueError("Group name is too long for binary mesh format: %s" % name)
+
+        vertexCount = len(vbo) // VERTEX_SIZE
+        vertexFormat = vertexFormatFor(vbo, quantizeNormals, quantizeUV)
+        vboData = encodeVertices(vbo, vertexFormat)
+        iboData = toBytes(array('H' if indexSize(vertexCount) == 2 else 'I', ibo))
+        iboPadding = b"\0" * (-len(iboData) % 4)
+
+        vboOffset = offset
+        iboOffset = vboOffset + len(vboData)
+        offset = iboOffset + len(iboData) + len(iboPadding)
+
+        entry = BINARY_GROUP.pack(encodedName, vertexFormat, vertexStride(vertexFormat), vertexCount,
+            indexSize(vertexCount), len(ibo), vboOffset, iboOffset)
+        blocks.append((entry, vboData + iboData + iboPadding))
+
+    with open(output_file, "wb") as f:
+        f.write(BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, len(meshes)))
+        for entry, data in blocks:
+            f.write(entry)
+        for entry, data in blocks:
+            f.write(data)
 
 def packVBO(obj, groupName):
-    vbo = OrderedSet()
-    ibo = []
-    
-    groupFaces = obj['groups'][groupName]
-
-    for face in groupFaces:
-        for vtx in face:
-            v_idx = int(vtx[0]) - 1
-            uv_idx = int(vtx[1]) - 1
-            vn_idx = int(vtx[2]) - 1
-            v = obj['vertices'][v_idx]
-            uv = obj['uv'][uv_idx]
-            vn = obj['normals'][vn_idx]
-            vtx_tuple = (v, vn, uv)
-            vbo.add(vtx_tuple)
-            ibo.append(vbo.index(vtx_tuple))
-
-    return list(vbo), ibo
+    """
+    Returns interleaved vertex buffer (8 floats per vertex) and index buffer for group
+    """
+    group = obj['groups'][groupName]
+    positions, normals, uvs = obj['vertices'], obj['normals'], obj['uv']
+    vbo = array('d')
+    for v_idx, vn_idx, uv_idx in group.corners:
+        # missing components (v//vn, v/vt) are filled with zeros
+        vbo.extend(positions[3 * v_idx : 3 * v_idx + 3] if v_idx >= 0 else (0.0, 0.0, 0.0))
+        vbo.extend(normals[3 * vn_idx : 3 * vn_idx + 3] if vn_idx >= 0 else (0.0, 0.0, 0.0))
+        vbo.extend(uvs[2 * uv_idx : 2 * uv_idx + 2] if uv_idx >= 0 else (0.0, 0.0))
+
+    return vbo, group.ibo
+
+def measureACMR(ibo, cacheSize = ACMR_CACHE_SIZE):
+    """
+    Returns average cache miss ratio: vertex shader invocations per triangle
+    for a FIFO post-transform cache of given size
+    """
+    triangles = len(ibo) // 3
+    if not triangles:
+        return 0.0
+
+    cache = collections.deque()
+    cached = set()
+    misses = 0
+    for idx in ibo:
+        if idx not in cached:
+            misses += 1
+            cache.append(idx)
+            cached.add(idx)
+            if len(cache) > cacheSize:
+                cached.discard(cache.popleft())
+    return float(misses) / triangles
+
+def reorderTriangles(ibo, vertexCount, cacheSize = OPTIMIZER_CACHE_SIZE):
+    """
+    Returns index buffer with triangles reordered for post-transform cache locality.
+    Implements Tom Forsyth's "Linear-Speed Vertex Cache Optimisation".
+    """
+    triCount = len(ibo) // 3
+
+    # score tables indexed by cache position and remaining triangle count
+    positionScore = [0.75] * 3 + [(1.0 - float(i - 3) / (cacheSize - 3)) ** 1.5 for i in range(3, cacheSize)]
+    maxValence = 32
+    valenceScore = [0.0] + [2.0 * n ** -0.5 for n in range(1, maxValence)]
+
+    vertexTris = [[] for i in range(vertexCount)]
+    for tri in range(triCount):
+        for idx in ibo[3 * tri : 3 * tri + 3]:
+            vertexTris[idx].append(tri)
+
+    remaining = [len(tris) for tris in vertexTris]
+    cachePos = [-1] * vertexCount
+
+    def vertexScore(v):
+        n = remaining[v]
+        if n == 0:
+            return -1.0
+        pos = cachePos[v]
+        score = positionScore[pos] if pos >= 0 else 0.0
+        return score + (valenceScore[n] if n < maxValence else 2.0 * n ** -0.5)
+
+    score = [vertexScore(v) for v in range(vertexCount)]
+    triScore = [score[ibo[3 * t]] + score[ibo[3 * t + 1]] + score[ibo[3 * t + 2]] for t in range(triCount)]
+    emitted = bytearray(triCount)
+
+    out = array('I')
+    cache = []
+    best = max(range(triCount), key = triScore.__getitem__) if triCount else -1
+    cursor = 0
+    while best >= 0:
+        emitted[best] = 1
+        corners = ibo[3 * best : 3 * best + 3]
+        out.extend(corners)
+
+        for v in corners:
+            remaining[v] -= 1
+            vertexTris[v].remove(best)
+        cache = list(corners) + [v for v in cache if v not in corners]
+
+        # vertices pushed out of cache lose position score
+        for v in cache[cacheSize:]:
+            cachePos[v] = -1
+            score[v] = vertexScore(v)
+        del cache[cacheSize:]
+
+        changed = set()
+        for pos, v in enumerate(cache):
+            cachePos[v] = pos
+            score[v] = vertexScore(v)
+            changed.update(vertexTris[v])
+
+        best, bestScore = -1, -1.0
+        for t in changed:
+            triScore[t] = score[ibo[3 * t]] + score[ibo[3 * t + 1]] + score[ibo[3 * t + 2]]
+            if triScore[t] > bestScore:
+                best, bestScore = t, triScore[t]
+
+        if best < 0:
+            # nothing adjacent to cache, continue with next unused triangle
+            while cursor < triCount and emitted[cursor]:
+                cursor += 1
+            best = cursor if cursor < triCount else -1
+
+    return out
+
+def reorderVertices(vbo, ibo):
+    """
+    Returns vbo and ibo with vertices sorted in order of first use by index buffer
+    """
+    remap = {}
+    newIbo = array('I')
+    newVbo = array('d')
+    for idx in ibo:
+        slot = remap.get(idx)
+        if slot is None:
+            slot = remap[idx] = len(remap)
+            newVbo.extend(vbo[VERTEX_SIZE * idx : VERTEX_SIZE * (idx + 1)])
+        newIbo.append(slot)
+    return newVbo, newIbo
+
+def splitIndices(vbo, ibo, maxVertices = MAX_SHORT_INDEX_VERTICES):
+    """
+    Splits mesh into pieces that reference at most maxVertices vertices each,
+    so every piece can use 16 bit indices. Returns list of (vbo, ibo)
+    """
+    if len(vbo) // VERTEX_SIZE <= maxVertices:
+        return [(vbo, ibo)]
+
+    pieces = []
+    start = 0
+    used = set()
+    for tri in range(len(ibo) // 3):
+        corners = ibo[3 * tri : 3 * tri + 3]
+        added = len([v for v in set(corners) if v not in used])
+        if len(used) + added > maxVertices:
+            pieces.append(reorderVertices(vbo, ibo[start : 3 * tri]))
+            start = 3 * tri
+            used = set()
+        used.update(corners)
+    pieces.append(reorderVertices(vbo, ibo[start:]))
+    return pieces
+
+def optimizeMesh(name, vbo, ibo, quantizeNormals = False, quantizeUV = False, verbose = True):
+    """
+    Optimization stage for packed group: reorders triangles for vertex cache,
+    reorders vertices by first use and splits group so indices fit 16 bits.
+    Returns list of (name, vbo, ibo); piece names get _1, _2... suffixes when group is split.
+    """
+    vertexCount = len(vbo) // VERTEX_SIZE
+    acmrBefore = measureACMR(ibo)
+    sizeBefore = meshByteSize(vertexCount, len(ibo))
+
+    ibo = reorderTriangles(ibo, vertexCount)
+    pieces = splitIndices(*reorderVertices(vbo, ibo))
+
+    acmrAfter = sum([measureACMR(p[1]) * len(p[1]) for p in pieces]) / max(len(ibo), 1)
+    sizeAfter = sum([meshByteSize(len(p[0]) // VERTEX_SIZE, len(p[1]), vertexFormatFor(p[0], quantizeNormals, quantizeUV)) for p in pieces])
+
+    if verbose:
+        print("%s: %d triangles, ACMR %.3f -> %.3f, %d -> %d bytes, %d piece(s)" %
+            (name, len(ibo) // 3, acmrBefore, acmrAfter, sizeBefore, sizeAfter, len(pieces)))
+
+    if len(pieces) == 1:
+        return [(name,) + pieces[0]]
+    return [("%s_%d" % (name, i + 1),) + piece for i, piece in enumerate(pieces)]
 
 def readObj(input_file):
     """
-    Returns dictionary representing 3D objects from obj file
-    Dict format: 
-        {   vertices : list, 
-            uv : list, 
-            groups : { 
-                name : [(vtx_idx, uv_idx), (vtx_idx, uv_idx), (vtx_idx, uv_idx)]
+    Returns dictionary representing 3D objects from obj file. File is streamed once.
+    Dict format:
+        {   vertices : array of floats (x, y, z),
+            normals : array of floats (x, y, z),
+            uv : array of floats (u, v),
+            groups : {
+                name : ObjGroup
             }
         }
     """
-    global currentGroup
+    obj = {'vertices' : array('d'), 'normals' : array('d'), 'uv' : array('d'), 'groups' : collections.OrderedDict()}
+    vertices, normals, uvs, groups = obj['vertices'], obj['normals'], obj['uv'], obj['groups']
     currentGroup = None
-    obj = {'vertices' : [], 'normals' : [], 'uv' : [], 'groups' : {}}
-
-    def writeVertex(data):
-        obj['vertices'].append(tuple(data[1:]))
-
-    def writeNormal(data):
-        obj['normals'].append(tuple(data[1:]))
-
-    def writeUV(data):
-        # flip v
-        uv = data[1:]
-        uv = [uv[0], str(1.0 - float(uv[1]))]
-        obj['uv'].append(tuple(uv))
-
-    def writeGroup(data):
-        global currentGroup
-        currentGroup = data[1]
-        obj['groups'][currentGroup] = []
-
-    def writeFace(data):
-        global currentGroup
-        if currentGroup is None:
-            currentGroup = 'obj'
-            obj['groups'][currentGroup] = []    
-        face = [tuple(x.split('/')) for x in data[1:]]
-        obj['groups'][currentGroup].append(tuple(face))
-
-    commands = {
-        'v' : writeVertex,
-        'vn' : writeNormal,
-        'vt' : writeUV,
-        'g' : writeGroup,
-        'f' : writeFace,
-    }
-
-    with open(input_file, "rU") as f:
-        for line in f:
-            s = [x.strip() for x in line.split()]
-            if s and s[0] in commands:
-                commands[s[0]](s)
+
+    def resolve(idx, count, kind, lineNumber):
+        # obj indices are 1-based, negative ones are relative to the end of the list
+        if not idx:
+            return -1
+        resolved = int(idx) - 1 if int(idx) > 0 else count + int(idx)
+        if not 0 <= resolved < count:
+            raise ValueError("%s:%d: %s index %s is out of range, %d defined" % (input_file, lineNumber, kind, idx, count))
+        return resolved
+
+    with open(input_file, "r") as f:
+        for lineNumber, line in enumerate(f, 1):
+            s = line.split()
+            if not s:
+                continue
+            cmd = s[0]
+            if cmd == 'v':
+                vertices.extend((float(s[1]), float(s[2]), float(s[3])))
+            elif cmd == 'vn':
+                normals.extend((float(s[1]), float(s[2]), float(s[3])))
+            elif cmd == 'vt':
+                # flip v
+                uvs.extend((float(s[1]), 1.0 - float(s[2])))
+            elif cmd == 'g':
+                currentGroup = groups[s[1]] = ObjGroup(s[1])
+            elif cmd == 'f':
+                if currentGroup is None:
+                    currentGroup = groups['obj'] = ObjGroup('obj')
+                nv, nvt, nvn = len(vertices) // 3, len(uvs) // 2, len(normals) // 3
+                for corner in s[1:]:
+                    idx = corner.split('/') + ['', '']
+                    currentGroup.addCorner((resolve(idx[0], nv, 'v', lineNumber), resolve(idx[2], nvn, 'vn', lineNumber),
+                        resolve(idx[1], nvt, 'vt', lineNumber)))
 
     return obj
 
-def fbxToMoaiMesh(input_file, output_file):
+def fbxToMoaiMesh(input_file, output_file, format = 'lua', optimize = False, quantizeNormals = False, quantizeUV = False):
+    if (quantizeNormals or quantizeUV) and format != 'binary':
+        raise ValueError("quantization is supported only for binary format")
     obj = readObj(input_file)
 
-    moai_code = "local objects = {}\n"
-    pp = pprint.PrettyPrinter()
-    for name in obj['groups']:
-        if obj['groups'][name]:
+    meshes = []
+    for name, group in obj['groups'].items():
+        if group:
             vbo, ibo = packVBO(obj, name)
-            mesh = writeLuaMesh(vbo, ibo)
-            moai_code += "objects.%s = %s\n" % (name, mesh)
+            if optimize:
+                meshes.extend(optimizeMesh(name, vbo, ibo, quantizeNormals, quantizeUV))
+            else:
+                meshes.append((name, vbo, ibo))
 
-    moai_code += "return objects"
+    if format == 'binary':
+        writeBinaryMesh(meshes, output_file, quantizeNormals, quantizeUV)
+        return
+
+    moai_code = ["local objects = {}\n"]
+    for name, vbo, ibo in meshes:
+        mesh = writeLuaMesh(vbo, ibo)
+        moai_code.append("objects.%s = %s\n" % (name, mesh))
+
+    moai_code.append("return objects")
     with open(output_file, "w") as f:
-        f.write(moai_code)
+        f.write(''.join(moai_code))
 
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument('-o', '--out', help="Output file", default = "mesh.lua")
+    parser.add_argument('-o', '--out', help="Output file. Defaults to mesh.lua or mesh.bin depending on format")
+    parser.add_argument('-f', '--format', help="Output format: lua table or binary buffers for ResourceMgr:getMesh", choices=['lua', 'binary'], default = 'lua')
+    parser.add_argument('--optimize', help="Reorder triangles for vertex cache and split groups to fit 16 bit indices. Prints ACMR and size report", action='store_true')
+    parser.add_argument('--quantize-normals', help="Store normals as normalized bytes (binary format only)", action='store_true')
+    parser.add_argument('--quantize-uv', help="Store UVs as normalized shorts when they are within [0, 1] (binary format only)", action='store_true')
     parser.add_argument('file', help="Input file in obj format")
     args = parser.parse_args()
 
-    output_file = args.out
-    input_file = args.file
+    if (args.quantize_normals or args.quantize_uv) and args.format != 'binary':
+        parser.error("--quantize-normals and --quantize-uv require --format binary")
 
-    fbxToMoaiMesh(input_file, output_file)
-
-
-class OrderedSet(collections.MutableSet):
-
-    def __init__(self, iterable=None):
-        self.end = end = [] 
-        end += [None, end, end]         # sentinel node for doubly linked list
-        self.map = {}                   # key --> [key, prev, next]
-        if iterable is not None:
-            self |= iterable
-
-    def __len__(self):
-        return len(self.map)
-
-    def __contains__(self, key):
-        return key in self.map
-
-    def add(self, key):
-        if key not in self.map:
-            end = self.end
-            curr = end[1]
-            curr[2] = end[1] = self.map[key] = [key, curr, end]
-
-    def index(self, elem):
-        if elem in self.map:
-            return next(i for i, e in enumerate(self) if e == elem)
-        else:
-            raise KeyError("That element isn't in the set")
-
-    def discard(self, key):
-        if key in self.map:        
-            key, prev, next = self.map.pop(key)
-            prev[2] = next
-            next[1] = prev
-
-    def __iter__(self):
-        end = self.end
-        curr = end[2]
-        while curr is not end:
-            yield curr[0]
-            curr = curr[2]
-
-    def __reversed__(self):
-        end = self.end
-        curr = end[1]
-        while curr is not end:
-            yield curr[0]
-            curr = curr[1]
-
-    def pop(self, last=True):
-        if not self:
-            raise KeyError('set is empty')
-        key = self.end[1][0] if last else self.end[2][0]
-        self.discard(key)
-        return key
-
-    def __repr__(self):
-        if not self:
-            return '%s()' % (self.__class__.__name__,)
-        return '%s(%r)' % (self.__class__.__name__, list(self))
-
-    def __eq__(self, other):
-        if isinstance(other, OrderedSet):
-            return len(self) == len(other) and list(self) == list(other)
-        return set(self) == set(other)
+    output_file = args.out or (args.format == 'binary' and "mesh.bin" or "mesh.lua")
+    input_file = args.file
 
+    fbxToMoaiMesh(input_file, output_file, args.format, args.optimize, args.quantize_normals, args.quantize_uv)
 
 
 if __name__ == '__main__':
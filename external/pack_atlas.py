@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+
+import re, os
+import argparse
+import glob
+
+from PIL import Image
+
+# Lua code templates, same layout as TexturePacker moai exporter
+atlasLua = """--------------------------------------------------------------------------------
+-- %(name)s
+--
+-- WARNING: Do not edit!
+-- This file is auto generated, all changes will be lost.
+--------------------------------------------------------------------------------
+
+return {
+	texture = '%(texture)s',
+	frames = {
+%(frames)s
+	}
+}
+"""
+
+frameLua = """			{
+				name = "%(name)s",
+				spriteColorRect = { x = 0, y = 0, width = %(width)d, height = %(height)d },
+				uvRect = { u0 = %(u0)g, v0 = %(v0)g, u1 = %(u1)g, v1 = %(v1)g },
+				spriteSourceSize = { width = %(width)d, height = %(height)d },
+				spriteTrimmed = false,
+				textureRotated = false
+			},"""
+
+spriteRe = re.compile(r'Sprite \("([^"]+)"|fileName = "([^"]+)"')
+
+
+def collectFiles(inputs, ext):
+    """
+    Expands list of files, directories and glob patterns into sorted list of files with given extension
+    """
+    files = set()
+    for pattern in inputs:
+        for path in (glob.glob(pattern) or [pattern]):
+            if os.path.isdir(path):
+                for root, dirs, names in os.walk(path):
+                    files.update([os.path.join(root, name) for name in names if name.endswith(ext) and not name.startswith('.')])
+            else:
+                files.add(path)
+    return sorted(files)
+
+def collectSprites(layoutFile):
+    """
+    Returns sorted list of sprite file names referenced by compiled layout
+    """
+    with open(layoutFile) as f:
+        code = f.read()
+    return sorted(set([a or b for a, b in spriteRe.findall(code)]))
+
+
+class SkylinePacker(object):
+    """SkylinePacker
+    Bottom-left skyline bin packing into a fixed size page.
+    """
+    def __init__(self, width, height):
+        super(SkylinePacker, self).__init__()
+        self.width = width
+        self.height = height
+        # segments of skyline: [x, y, width]
+        self.skyline = [[0, 0, width]]
+
+    def fit(self, index, width, height):
+        """
+        Returns top y of rect placed at skyline segment index, or None if it doesn't fit
+        """
+        x = self.skyline[index][0]
+        if x + width > self.width:
+            return None
+        y = 0
+        widthLeft = width
+        i = index
+        while widthLeft > 0:
+            y = max(y, self.skyline[i][1])
+            if y + height > self.height:
+                return None
+            widthLeft -= self.skyline[i][2]
+            i += 1
+            if widthLeft > 0 and i == len(self.skyline):
+                return None
+        return y
+
+    def insert(self, width, height):
+        """
+        Returns (x, y) of placed rect or None if page is full
+        """
+        best, bestIndex = None, -1
+        for i in range(len(self.skyline)):
+            y = self.fit(i, width, height)
+            if y is not None:
+                key = (y + height, self.skyline[i][0])
+                if best is None or key < best:
+                    best, bestIndex = key, i
+        if best is None:
+            return None
+
+        x, y = self.skyline[bestIndex][0], best[0] - height
+        self.skyline.insert(bestIndex, [x, y + height, width])
+
+        # shrink or remove segments covered by the new one
+        i = bestIndex + 1
+        while i < len(self.skyline):
+            segment, previous = self.skyline[i], self.skyline[i - 1]
+            shrink = previous[0] + previous[2] - segment[0]
+            if shrink <= 0:
+                break
+            segment[0] += shrink
+            segment[2] -= shrink
+            if segment[2] > 0:
+                break
+            del self.skyline[i]
+
+        # merge segments of the same height
+        i = 0
+        while i < len(self.skyline) - 1:
+            if self.skyline[i][1] == self.skyline[i + 1][1]:
+                self.skyline[i][2] += self.skyline[i + 1][2]
+                del self.skyline[i + 1]
+            else:
+                i += 1
+        return x, y
+
+
+def powerOfTwoFloor(size):
+    result = 1
+    while result * 2 <= size:
+        result *= 2
+    return result
+
+def packPage(sizes, maxSize, padding):
+    """
+    Packs as many of (name, width, height) as fit into single page.
+    Page size is the smallest power of two square or 2:1 rect holding everything, up to maxSize.
+    Returns (width, height, {name : (x, y)}, rest)
+    """
+    area = sum([(w + padding) * (h + padding) for name, w, h in sizes])
+    candidates = []
+    size = 32
+    while size <= maxSize:
+        candidates += [(size, size // 2), (size, size)]
+        size *= 2
+    candidates = [c for c in candidates if c[0] * c[1] >= area] or [(maxSize, maxSize)]
+
+    for width, height in candidates:
+        packer = SkylinePacker(width, height)
+        placed, rest = {}, []
+        for name, w, h in sizes:
+            pos = packer.insert(w + padding, h + padding)
+            if pos is None:
+                rest.append((name, w, h))
+            else:
+                placed[name] = pos
+        if not rest or (width, height) == (maxSize, maxSize):
+            return width, height, placed, rest
+    return width, height, placed, rest
+
+def writeAtlas(name, outDir, imagesDir, width, height, placed, sizes, padding):
+    """
+    Writes atlas png and lua descriptor for placed sprites. Returns descriptor path
+    """
+    atlas = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+    frames = []
+    for spriteName in sorted(placed):
+        x, y = placed[spriteName]
+        x, y = x + padding // 2, y + padding // 2
+        w, h = sizes[spriteName]
+        image = Image.open(os.path.join(imagesDir, spriteName)).convert("RGBA")
+        atlas.paste(image, (x, y))
+        frames.append(frameLua % {
+            'name' : spriteName,
+            'width' : w,
+            'height' : h,
+            'u0' : float(x) / width,
+            'v0' : float(y) / height,
+            'u1' : float(x + w) / width,
+            'v1' : float(y + h) / height,
+        })
+
+    textureName = name + '.png'
+    atlas.save(os.path.join(outDir, textureName))
+    luaPath = os.path.join(outDir, name + '.lua')
+    with open(luaPath, "w") as f:
+        f.write(atlasLua % {'name' : name + '.lua', 'texture' : textureName, 'frames' : '\n'.join(frames)})
+    return luaPath
+
+def packGroup(name, sprites, sizes, outDir, imagesDir, maxSize, padding):
+    """
+    Packs sprites into one or more atlas pages (name, name_2, ...). Returns {sprite : atlas name}
+    """
+    # tallest first gives the best skyline fill
+    pending = sorted([(s, sizes[s][0], sizes[s][1]) for s in sprites], key = lambda x: (-x[2], -x[1], x[0]))
+    atlases = {}
+    page = 1
+    while pending:
+        pageName = page == 1 and name or "%s_%d" % (name, page)
+        width, height, placed, pending = packPage(pending, maxSize, padding)
+        if not placed:
+            raise ValueError("sprites don't fit into %dx%d page: %s" % (maxSize, maxSize, ', '.join([s[0] for s in pending])))
+        writeAtlas(pageName, outDir, imagesDir, width, height, placed, sizes, padding)
+        print("%s.png: %dx%d, %d sprites" % (pageName, width, height, len(placed)))
+        for sprite in placed:
+            atlases[sprite] = pageName
+        page += 1
+    return atlases
+
+def groupSprites(layouts, mode):
+    """
+    Splits sprites into atlas groups. Frame names must be unique across atlases for ResourceMgr,
+    so sprites used by several layouts always go into the shared group.
+    mode 'screen': sprites used by a single layout are packed into atlas of that layout
+    mode 'shared': all sprites are packed into shared atlas
+    Returns {group name : set of sprites}
+    """
+    usage = {}
+    for layout, sprites in layouts.items():
+        for sprite in sprites:
+            usage.setdefault(sprite, set()).add(layout)
+
+    groups = {}
+    for sprite, users in usage.items():
+        if mode == 'screen' and len(users) == 1:
+            group = os.path.splitext(os.path.basename(list(users)[0]))[0]
+        else:
+            group = 'shared'
+        groups.setdefault(group, set()).add(sprite)
+    return groups
+
+def packLayouts(layoutFiles, imagesDir, outDir, mode = 'screen', maxSize = 2048, padding = 2, prefix = 'atlas_'):
+    layouts = dict([(path, collectSprites(path)) for path in layoutFiles])
+    # pages are power of two sized
+    if powerOfTwoFloor(maxSize) != maxSize:
+        print("Max atlas size %d is not a power of two, using %d" % (maxSize, powerOfTwoFloor(maxSize)))
+        maxSize = powerOfTwoFloor(maxSize)
+
+    sizes = {}
+    for sprite in set([s for sprites in layouts.values() for s in sprites]):
+        path = os.path.join(imagesDir, sprite)
+        if not os.path.isfile(path):
+            print("Image not found, left unpacked: %s" % path)
+            continue
+        w, h = Image.open(path).size
+        if w + padding > maxSize or h + padding > maxSize:
+            print("Image is too large for atlas, left unpacked: %s" % path)
+            continue
+        sizes[sprite] = (w, h)
+
+    if not os.path.isdir(outDir):
+        os.makedirs(outDir)
+
+    atlases = {}
+    groups = groupSprites(dict([(l, [s for s in sprites if s in sizes]) for l, sprites in layouts.items()]), mode)
+    for group in sorted(groups):
+        atlases.update(packGroup(prefix + group, groups[group], sizes, outDir, imagesDir, maxSize, padding))
+
+    print("%-40s %8s %8s" % ("layout", "before", "after"))
+    for layout in sorted(layouts):
+        sprites = layouts[layout]
+        after = len(set([atlases.get(s, s) for s in sprites]))
+        print("%-40s %8d %8d" % (os.path.basename(layout), len(sprites), after))
+    return atlases
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Packs sprites referenced by compiled layouts into texture atlases for ResourceMgr")
+    parser.add_argument('-i', '--images', help="Directory with sprite images (one scale folder, e.g. hd)", required = True)
+    parser.add_argument('-o', '--out', help="Output directory for atlas png and lua files", default = "atlases")
+    parser.add_argument('-m', '--mode', help="screen: atlas per layout plus shared atlas for common sprites, shared: single shared atlas", choices = ['screen', 'shared'], default = 'screen')
+    parser.add_argument('-s', '--maxSize', help="Maximum atlas page size", default = 2048, type = int)
+    parser.add_argument('-p', '--padding', help="Padding between sprites in pixels", default = 2, type = int)
+    parser.add_argument('--prefix', help="Atlas file name prefix", default = "atlas_")
+    parser.add_argument('layouts', help="Compiled layout lua files, directories or glob patterns", nargs = '+')
+    args = parser.parse_args()
+
+    layoutFiles = collectFiles(args.layouts, '.lua')
+    packLayouts(layoutFiles, args.images, args.out, args.mode, args.maxSize, args.padding, args.prefix)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+
+"""
+Watch mode for asset converters.
+Keeps compile_layout.py, obj_converter.py and nine-patch-resizer.py loaded, polls source folders
+and rebuilds only outputs affected by changed files. Outputs are written into project folders
+watched by LiveReloadServer, files with unchanged content are not touched.
+"""
+
+import sys, os, argparse
+import time, tempfile
+
+import compile_layout
+import obj_converter
+
+
+def loadModule(name, path):
+    """
+    Loads python module from file which name is not a valid identifier (nine-patch-resizer.py)
+    """
+    try:
+        import importlib.util
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    except ImportError:
+        import imp
+        return imp.load_source(name, path)
+
+selfDir = os.path.dirname(os.path.realpath(__file__))
+resizer = loadModule('nine_patch_resizer', os.path.join(selfDir, 'nine-patch-resizer.py'))
+
+
+def log(message):
+    print("[%s] %s" % (time.strftime("%H:%M:%S"), message))
+    sys.stdout.flush()
+
+
+class SourceRule(object):
+    """SourceRule
+    Kind of source files in input folder and how to build them into output folder.
+    build(path, relPath) returns (written, deps): whether output files were rewritten
+    and list of extra files the output depends on (fonts etc.).
+    outputs(relPath) returns output files of the source, they are removed when the source is deleted.
+    """
+    def __init__(self, name, inDir, outDir, extensions, build, outputs, remove = None):
+        super(SourceRule, self).__init__()
+        self.name = name
+        self.inDir = inDir
+        self.outDir = outDir
+        self.extensions = extensions
+        self.build = build
+        self.outputs = outputs
+        self.remove = remove
+
+    def matches(self, path):
+        return path.lower().endswith(self.extensions) and not os.path.basename(path).startswith('.')
+
+    def scan(self):
+        files = {}
+        for root, dirs, names in os.walk(self.inDir):
+            for name in names:
+                path = os.path.join(root, name)
+                if self.matches(path):
+                    files[path] = self
+        return files
+
+
+class AssetWatcher(object):
+    """AssetWatcher
+    Polls sources of all rules and their extra dependencies, debounces bursts of changes
+    and rebuilds affected sources.
+    """
+    def __init__(self, rules, interval = 0.1, debounce = 0.25):
+        super(AssetWatcher, self).__init__()
+        self.rules = rules
+        self.interval = interval
+        self.debounce = debounce
+        self.sources = {}
+        self.mtimes = {}
+        # extra dependency path -> set of source paths
+        self.dependents = {}
+
+    def scan(self):
+        """
+        Returns {path : mtime} for all sources and dependencies
+        """
+        self.sources = {}
+        for rule in self.rules:
+            self.sources.update(rule.scan())
+
+        mtimes = {}
+        for path in list(self.sources) + list(self.dependents):
+            try:
+                mtimes[path] = os.path.getmtime(path)
+            except OSError:
+                pass
+        return mtimes
+
+    def changedFiles(self, mtimes):
+        paths = set(mtimes) | set(self.mtimes)
+        return set([path for path in paths if mtimes.get(path) != self.mtimes.get(path)])
+
+    def affectedSources(self, changed):
+        affected = set()
+        for path in changed:
+            if path in self.sources:
+                affected.add(path)
+            affected.update([source for source in self.dependents.get(path, ()) if source in self.sources])
+        return affected
+
+    def rebuild(self, paths):
+        start = time.time()
+        failed = upToDate = 0
+        for path in sorted(paths):
+            rule = self.sources[path]
+            relPath = os.path.relpath(path, rule.inDir)
+            buildStart = time.time()
+            try:
+                written, deps = rule.build(path, relPath)
+            except (Exception, SystemExit) as e:
+                failed += 1
+                log("%s %s failed: %s: %s" % (rule.name, relPath, type(e).__name__, e))
+                continue
+
+            for dependents in self.dependents.values():
+                dependents.discard(path)
+            for dep in deps:
+                self.dependents.setdefault(dep, set()).add(path)
+            if not written:
+                upToDate += 1
+                continue
+            log("%s %s rebuilt in %.0f ms" % (rule.name, relPath, 1000 * (time.time() - buildStart)))
+
+        self.dependents = dict([(dep, sources) for dep, sources in self.dependents.items() if sources])
+        log("%d rebuilt, %d up to date, %d failed in %.0f ms" % (len(paths) - failed - upToDate, upToDate, failed, 1000 * (time.time() - start)))
+
+    def removeSources(self, removed):
+        """
+        Removes outputs of deleted sources. Copies already pushed to devices stay there until app restart
+        """
+        for path, rule in sorted(removed.items()):
+            relPath = os.path.relpath(path, rule.inDir)
+            for dependents in self.dependents.values():
+                dependents.discard(path)
+            outputs = [output for output in rule.outputs(relPath) if os.path.isfile(output)]
+            for output in outputs:
+                os.remove(output)
+            if rule.remove:
+                rule.remove(relPath)
+            log("%s %s removed, deleted outputs: %s" % (rule.name, relPath, ', '.join(outputs) or "none"))
+        self.dependents = dict([(dep, sources) for dep, sources in self.dependents.items() if sources])
+
+    def run(self, initialBuild = True):
+        self.mtimes = self.scan()
+        if initialBuild and self.sources:
+            self.rebuild(set(self.sources))
+            # dependencies found during initial build
+            self.mtimes = self.scan()
+        log("watching %d sources, %d dependencies" % (len(self.sources), len(self.dependents)))
+
+        pending = set()
+        removed = {}
+        lastChange = 0
+        while True:
+            time.sleep(self.interval)
+            known = self.sources
+            mtimes = self.scan()
+            changed = self.changedFiles(mtimes)
+            self.mtimes = mtimes
+            if changed:
+                pending.update(changed)
+                removed.update([(path, rule) for path, rule in known.items() if path not in self.sources])
+                lastChange = time.time()
+                continue
+
+            if pending and time.time() - lastChange >= self.debounce:
+                # sources saved again within debounce are rebuilt instead
+                removed = dict([(path, rule) for path, rule in removed.items() if path not in self.sources])
+                if removed:
+                    self.removeSources(removed)
+                affected = self.affectedSources(pending)
+                pending = set()
+                removed = {}
+                if affected:
+                    self.rebuild(affected)
+                    self.mtimes = self.scan()
+
+
+def layoutRule(inDir, outDir, params):
+    # font index stays in memory, so fontfinder runs once per font for the whole session
+    fontIndex = compile_layout.FontIndex(params.get('fontIndex'))
+
+    def outputs(relPath):
+        return [os.path.join(outDir, os.path.splitext(relPath)[0] + '.lua')]
+
+    def build(path, relPath):
+        written, fonts = compile_layout.compileLayout(path, outputs(relPath)[0], params, fontIndex)
+        fontIndex.save()
+        return written, [info['source'] for info in fonts.values()]
+
+    return SourceRule("layout", inDir, outDir, ('.json',), build, outputs)
+
+def meshRule(inDir, outDir, format, optimize, quantizeNormals, quantizeUV):
+    ext = format == 'binary' and '.bin' or '.lua'
+
+    def outputs(relPath):
+        return [os.path.join(outDir, os.path.splitext(relPath)[0] + ext)]
+
+    def build(path, relPath):
+        fd, tmp = tempfile.mkstemp(suffix = ext)
+        os.close(fd)
+        try:
+            obj_converter.fbxToMoaiMesh(path, tmp, format, optimize, quantizeNormals, quantizeUV)
+            with open(tmp, "rb") as f:
+                written = compile_layout.writeIfChanged(outputs(relPath)[0], f.read())
+        finally:
+            os.remove(tmp)
+        return written, []
+
+    return SourceRule("mesh", inDir, outDir, ('.obj',), build, outputs)
+
+def imageRule(inDir, outDir, inputScale):
+    targets = resizer.scaleTargets(inputScale)
+    settings = resizer.imageSettings(targets)
+    # cache is shared with nine-patch-resizer.py, it keeps nine patch index complete
+    # and lets initial build skip unchanged images
+    cache = resizer.loadCache(outDir)
+
+    def outputs(relPath):
+        return [os.path.join(outDir, folder, relPath) for folder, scale in targets]
+
+    def build(path, relPath):
+        imageHash = resizer.fileHash(path)
+        if resizer.isUpToDate(cache.get(relPath), imageHash, settings, outDir, relPath, targets):
+            return False, []
+        relPath, warnings, info = resizer.processImage((path, relPath, outDir, targets, inputScale))
+        for warning in warnings:
+            log("image %s: %s" % (relPath, warning))
+        cache[relPath] = resizer.cacheEntry(imageHash, settings, info)
+        resizer.saveCache(outDir, cache)
+        resizer.writeNinePatchIndex(outDir, cache)
+        return True, []
+
+    def remove(relPath):
+        if cache.pop(relPath, None):
+            resizer.saveCache(outDir, cache)
+            resizer.writeNinePatchIndex(outDir, cache)
+
+    return SourceRule("image", inDir, outDir, resizer.IMAGE_EXTENSIONS, build, outputs, remove)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Watches asset sources and rebuilds changed ones for live reload")
+    parser.add_argument('--layouts', help="Layout json folder and output folder for compiled layouts", nargs = 2, metavar = ('IN', 'OUT'))
+    parser.add_argument('--meshes', help="Obj folder and output folder for meshes", nargs = 2, metavar = ('IN', 'OUT'))
+    parser.add_argument('--images', help="Retina images folder and output root for sd/hd/ipad-hd folders", nargs = 2, metavar = ('IN', 'OUT'))
+
+    parser.add_argument('-width', help="Layouts: target width (in virtual coordinates)", default = 320, type=int)
+    parser.add_argument('-height', help="Layouts: target height (in virtual coordinates)", default = 568, type=int)
+    parser.add_argument('-ox', '--offsetX', help="Layouts: canvas offset X (in virtual coordinates)", default = 0, type=int)
+    parser.add_argument('-oy', '--offsetY', help="Layouts: canvas offset Y (in virtual coordinates)", default = 0, type=int)
+    parser.add_argument('-fonts', help="Layouts: output path for font files from layout", default = "fonts", type=str)
+    parser.add_argument('-fp', '--fontPrefix', help="Layouts: font path prefix that will be added to included font file names", default = "", type=str)
+    parser.add_argument('--fontIndex', help="Layouts: persistent font name to path index", default = os.path.join(os.path.expanduser('~'), '.compile_layout_fonts.json'), type=str)
+    parser.add_argument('--meshFormat', help="Meshes: output format", choices = ['lua', 'binary'], default = 'lua')
+    parser.add_argument('--optimize', help="Meshes: run vertex cache optimization", action = 'store_true')
+    parser.add_argument('--quantize-normals', help="Meshes: store normals as normalized bytes (binary format only)", action = 'store_true')
+    parser.add_argument('--quantize-uv', help="Meshes: store UVs as normalized shorts when they are within [0, 1] (binary format only)", action = 'store_true')
+    parser.add_argument('--imageScale', help="Images: input images scale", choices = ['2', '4'], default = '2')
+
+    parser.add_argument('--interval', help="Polling interval in seconds", default = 0.1, type=float)
+    parser.add_argument('--debounce', help="Seconds without changes before rebuilding a burst of saves", default = 0.25, type=float)
+    parser.add_argument('--noInitialBuild', help="Don't rebuild everything on start", action = 'store_true')
+    args = parser.parse_args()
+
+    rules = []
+    if args.layouts:
+        params = {
+            "offsetX" : args.offsetX,
+            "offsetY" : args.offsetY,
+            "targetWidth" : args.width,
+            "targetHeight" : args.height,
+            "fontsFolder" : args.fonts,
+            "fontPrefix" : args.fontPrefix,
+            "fontIndex" : args.fontIndex,
+        }
+        rules.append(layoutRule(args.layouts[0], args.layouts[1], params))
+    if args.meshes:
+        if (args.quantize_normals or args.quantize_uv) and args.meshFormat != 'binary':
+            parser.error("--quantize-normals and --quantize-uv require --meshFormat binary")
+        rules.append(meshRule(args.meshes[0], args.meshes[1], args.meshFormat, args.optimize, args.quantize_normals, args.quantize_uv))
+    if args.images:
+        rules.append(imageRule(args.images[0], args.images[1], int(args.imageScale)))
+
+    if not rules:
+        parser.error("nothing to watch, use --layouts, --meshes or --images")
+
+    watcher = AssetWatcher(rules, args.interval, args.debounce)
+    try:
+        watcher.run(not args.noInitialBuild)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -10,9 +10,16 @@ local App = require("core.App")
 
 local _createTexture
 local _createFont
+local _createMesh
+local _createVertexFormat
 local _createStretchRowsOrColumns
+local _createStretchSegments
 local _getNineImageContentPadding
 
+-- Bytes per writeInt8 call when mesh buffers are filled without copyFromStream,
+-- kept below Lua C stack limit for string.byte results
+local MESH_COPY_BLOCK = 4096
+
 --------------------------------------------------------------------------------
 -- Texture and Deck cache
 --------------------------------------------------------------------------------
@@ -21,11 +28,15 @@ ResourceMgr.resourceDirectories = {}
 ResourceMgr.filepathCache = {}
 ResourceMgr.textureCache = setmetatable({}, {__mode = "v"})
 ResourceMgr.fontCache = {}
+ResourceMgr.meshCache = setmetatable({}, {__mode = "v"})
 
 ResourceMgr.imageDecks = setmetatable({}, {__mode = "v"})
 ResourceMgr.atlasDecks = setmetatable({}, {__mode = "v"})
 ResourceMgr.nineImageDecks = setmetatable({}, {__mode = "v"})
 
+-- Nine patch metadata by file name, loaded from index written by cut_resize.py
+ResourceMgr.ninePatchIndex = {}
+
 -- Internal lookup table to find atlas name for given sprite name
 ResourceMgr.spriteFrameAtlases = {}
 
@@ -66,6 +77,106 @@ function _createFont(path)
     return font
 end
 
+---
+-- Constructor.
+-- Reads binary mesh file written by obj_converter.py --format binary.
+-- Vertex and index data of every group is copied straight from file into MOAI buffers.
+-- MOAI builds without copyFromStream fall back to copying 4 KB blocks through Lua,
+-- which is noticeably slower for large meshes.
+-- Position is always 3 floats, vertexFlags describe the rest of vertex:
+-- 1 - normal is 3 normalized bytes + padding, 2 - uv is 2 normalized shorts (floats otherwise)
+-- @param path Mesh path
+-- @return table {path, groups = {name = {vbo, ibo, vertexFormat, vertexFlags, vertexStride, vertexCount, indexSize, indexCount}}}
+function _createMesh(path)
+    local stream = MOAIFileStream.new()
+    assert(stream:open(path), "Can't open mesh: " .. path)
+    assert(stream:read(4) == "MOAM", "Not a binary mesh file: " .. path)
+    
+    local version = stream:readU32()
+    assert(version == 1, "Unsupported mesh version " .. tostring(version) .. ": " .. path)
+
+    local groupCount = stream:readU32()
+    local groups = {}
+    for i = 1, groupCount do
+        local group = {}
+        group.name = string.match(stream:read(32), "^[^%z]*")
+        group.vertexFlags = stream:readU32()
+        group.vertexStride = stream:readU32()
+        group.vertexCount = stream:readU32()
+        group.indexSize = stream:readU32()
+        group.indexCount = stream:readU32()
+        group.vboOffset = stream:readU32()
+        group.iboOffset = stream:readU32()
+        groups[i] = group
+    end
+
+    local mesh = {path = path, groups = {}}
+    for i, group in ipairs(groups) do
+        group.vertexFormat = _createVertexFormat(group.vertexFlags)
+
+        local vbo = MOAIVertexBuffer.new()
+        local vboSize = group.vertexCount * group.vertexStride
+        stream:seek(group.vboOffset)
+        if vbo.copyFromStream then
+            vbo:copyFromStream(stream, vboSize)
+        else
+            -- MOAI 1.4 buffers can't read streams: read blocks and write their bytes
+            -- with one writeInt8 call per block (it writes every argument)
+            vbo:setFormat(group.vertexFormat)
+            vbo:reserve(vboSize)
+            for blockStart = 1, vboSize, MESH_COPY_BLOCK do
+                local block = stream:read(math.min(MESH_COPY_BLOCK, vboSize - blockStart + 1))
+                vbo:writeInt8(string.byte(block, 1, #block))
+            end
+            vbo:bless()
+        end
+
+        local ibo = MOAIIndexBuffer.new()
+        stream:seek(group.iboOffset)
+        if ibo.copyFromStream then
+            ibo:setIndexSize(group.indexSize)
+            ibo:copyFromStream(stream, group.indexCount * group.indexSize)
+        else
+            assert(group.indexSize == 2, "32 bit indices are not supported by this MOAI version: " .. path)
+            ibo:reserve(group.indexCount)
+            local data = stream:read(group.indexCount * 2)
+            for j = 1, group.indexCount do
+                local lo, hi = string.byte(data, 2 * j - 1, 2 * j)
+                ibo:setIndex(j, lo + 256 * hi + 1)
+            end
+        end
+
+        group.vbo = vbo
+        group.ibo = ibo
+        mesh.groups[group.name] = group
+    end
+    stream:close()
+
+    return mesh
+end
+
+---
+-- Creates MOAIVertexFormat for binary mesh vertexFlags.
+-- Quantized normals and uv are declared as normalized attributes.
+-- @param flags vertexFlags from mesh file
+-- @return MOAIVertexFormat instance
+function _createVertexFormat(flags)
+    local format = MOAIVertexFormat.new()
+    format:declareAttribute(1, MOAIVertexFormat.GL_FLOAT, 3, false, MOAIVertexFormat.VERTEX_POSITION)
+    if flags % 2 == 1 then
+        -- 4th byte is padding
+        format:declareAttribute(2, MOAIVertexFormat.GL_BYTE, 4, true, MOAIVertexFormat.VERTEX_NORMAL)
+    else
+        format:declareAttribute(2, MOAIVertexFormat.GL_FLOAT, 3, false, MOAIVertexFormat.VERTEX_NORMAL)
+    end
+    if math.floor(flags / 2) % 2 == 1 then
+        format:declareAttribute(3, MOAIVertexFormat.GL_UNSIGNED_SHORT, 2, true, MOAIVertexFormat.VERTEX_UV)
+    else
+        format:declareAttribute(3, MOAIVertexFormat.GL_FLOAT, 2, false, MOAIVertexFormat.VERTEX_UV)
+    end
+    return format
+end
+
 ---
 -- Add the resource directory path.
 -- You can omit the file path by adding.
@@ -163,6 +274,25 @@ function ResourceMgr:getFont(path)
     return cache[path]
 end
 
+---
+-- Loads (or obtains from its cache) a binary mesh and returns it.
+-- Mesh files are produced by obj_converter.py with --format binary.
+-- @param path The path of the mesh file
+-- @return table with path and groups by name, each group has vbo, ibo and vertexFormat
+function ResourceMgr:getMesh(path)
+    local cache = self.meshCache
+    local filepath = self:getResourceFilePath(path)
+
+    assert(filepath, "Mesh not found: " .. path)
+
+    local mesh = cache[filepath]
+    if mesh == nil then
+        mesh = _createMesh(filepath)
+        cache[filepath] = mesh
+    end
+    return mesh
+end
+
 ---
 -- Returns the file data.
 -- @param fileName file name
@@ -359,11 +489,28 @@ function ResourceMgr:getNineImageDeck(filePath)
     return cache[filePath]
 end
 
+---
+-- Load nine patch metadata index written by cut_resize.py, nine-patch-resizer.py or watch_assets.py.
+-- Nine patches from index are shipped without marker border, stretch rows, columns
+-- and padding are taken from index instead of image pixels.
+-- @param luaFilePath index lua file
+function ResourceMgr:loadNinePatchIndex(luaFilePath)
+    local index = self:loadTable(luaFilePath)
+    for fileName, info in pairs(index) do
+        self.ninePatchIndex[fileName] = info
+    end
+end
+
 ---
 -- Create the Deck to draw NineImage.
 -- @param fileName fileName
 -- @return MOAIStretchPatch2D instance
 function ResourceMgr:createNineImageDeck(fileName)
+    local info = self.ninePatchIndex[fileName]
+    if info then
+        return self:createIndexedNineImageDeck(fileName, info)
+    end
+
     local texture = self:getTexture(fileName)
     local atlasDeck = nil
     
@@ -420,6 +567,74 @@ function ResourceMgr:createNineImageDeck(fileName)
     return deck
 end
 
+---
+-- Create the Deck to draw NineImage from nine patch index metadata.
+-- @param fileName fileName
+-- @param info index entry: scale, width, height, columns, rows, padding in pixels of index scale
+-- @return MOAIStretchPatch2D instance
+function ResourceMgr:createIndexedNineImageDeck(fileName, info)
+    local texture = self:getTexture(fileName)
+    local uvRect = {0, 1, 1, 0}
+
+    if not texture then
+        local atlas = self:getAtlasName(fileName)
+        assert(atlas, "Nine Image not found: " .. fileName)
+        local atlasDeck = self:getAtlasDeck(atlas)
+        local frame = atlasDeck.frames[ atlasDeck.names[fileName] ]
+        texture = self:getTexture(atlasDeck.texturePath)
+        uvRect = {frame.uvRect.u0, frame.uvRect.v1, frame.uvRect.u1, frame.uvRect.v0}
+    end
+
+    local displayWidth, displayHeight = info.width / info.scale, info.height / info.scale
+    local stretchRows = _createStretchSegments(info.rows, info.height, true)
+    local stretchColumns = _createStretchSegments(info.columns, info.width, false)
+    local padding = info.padding
+
+    local deck = MOAIStretchPatch2D.new()
+    deck.displayWidth = displayWidth
+    deck.displayHeight = displayHeight
+    deck.contentPadding = {padding[1] / info.scale, padding[2] / info.scale, padding[3] / info.scale, padding[4] / info.scale}
+    deck:reserveUVRects(1)
+    deck:setTexture(texture)
+    deck:setRect(-0.5 * displayWidth, -0.5 * displayHeight, 0.5 * displayWidth, 0.5 * displayHeight)
+    deck:setUVRect(1, unpack(uvRect))
+    deck:reserveRows(#stretchRows)
+    deck:reserveColumns(#stretchColumns)
+
+    for i, row in ipairs(stretchRows) do
+        deck:setRow(i, row.weight, row.stretch)
+    end
+    for i, column in ipairs(stretchColumns) do
+        deck:setColumn(i, column.weight, column.stretch)
+    end
+
+    return deck
+end
+
+---
+-- Converts stretch ranges {start, end} into segments covering whole size
+function _createStretchSegments(ranges, size, reverse)
+    local stretchs = {}
+    local pos = 0
+
+    for i, range in ipairs(ranges) do
+        if range[1] > pos then
+            table.insert(stretchs, {weight = (range[1] - pos) / size, stretch = false})
+        end
+        table.insert(stretchs, {weight = (range[2] - range[1]) / size, stretch = true})
+        pos = range[2]
+    end
+    if pos < size then
+        table.insert(stretchs, {weight = (size - pos) / size, stretch = false})
+    end
+
+    if reverse then
+        stretchs = table.reverse(stretchs)
+    end
+
+    return stretchs
+end
+
 function _createStretchRowsOrColumns(image, imageLeft, imageRight, imageTop, imageBottom, isRow)
     local stretchs = {}
     local from = isRow and (imageTop + 1) or (imageLeft + 1)